@@ -0,0 +1,270 @@
+import os
+import json
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import xarray as xr
+from bmtool.util.util import load_nodes_from_paths
+
+from . import utils, process
+from .cache import trial_cache
+from .plot import pop_names
+from build_input import get_populations
+
+RESULT_PATH = 'simulation_results'
+RUN_CONFIG = 'sonata_config.json'
+OUTPUT_FILE = 'batch_summary.nc'
+NETWORK_NAME = 'cortex'
+FS = 400.  # Hz. Sampling frequency of population spike rate
+TSEG = 0.5  # sec. Time segment length for PSD
+
+
+def is_trial_dir(path, run_config=RUN_CONFIG):
+    """Whether a directory is a trial result with a stimulus type in its name"""
+    if not any(os.path.isfile(os.path.join(path, f))
+               for f in (run_config, utils.STIMULUS_CONFIG['else'])):
+        return False
+    try:
+        utils.stimulus_type_from_trial_name(os.path.basename(path))
+    except StopIteration:
+        return False
+    return True
+
+
+def find_trials(result_path=RESULT_PATH, stimulus=None, run_config=RUN_CONFIG):
+    """Discover trial directories in result path, which are either directly in
+    the path or in subdirectories of stimulus types, e.g. `<stim>/<stim>_<n>`
+    stimulus: list of stimulus types to include. Defaults to all types.
+    Return: sorted list of trial paths
+    """
+    trial_paths = []
+    for d in os.listdir(result_path):
+        path = os.path.join(result_path, d)
+        if is_trial_dir(path, run_config):
+            trial_paths.append(path)
+        elif os.path.isdir(path):
+            trial_paths.extend(os.path.join(path, t) for t in os.listdir(path)
+                               if is_trial_dir(os.path.join(path, t), run_config))
+    if stimulus is not None:
+        trial_paths = [path for path in trial_paths if utils.
+            stimulus_type_from_trial_name(os.path.basename(path))[0] in stimulus]
+    return sorted(trial_paths)
+
+
+def trial_setting(trial_path, run_config=RUN_CONFIG):
+    """Resolve files and stimulus parameters of a trial from its config
+    Return: dictionary of settings
+    """
+    trial_name = os.path.basename(os.path.normpath(trial_path))
+    stimulus_type, _ = utils.stimulus_type_from_trial_name(trial_name)
+    isbaseline = stimulus_type == 'baseline' or stimulus_type == 'const'
+    isstandard = isbaseline or stimulus_type == 'short' or stimulus_type == 'long'
+
+    result_config_file = os.path.join(trial_path,
+        'config_no_STP.json' if 'no_STP' in trial_name else run_config)
+    if not os.path.isfile(result_config_file):
+        result_config_file = os.path.join(trial_path, utils.STIMULUS_CONFIG['else'])
+    config_hp = utils.ConfigHelper(result_config_file)
+    t_stop = config_hp.get_attr('run', 'tstop') / 1000
+
+    input_path, _ = os.path.split(config_hp.get_attr('inputs', 'baseline_spikes', 'input_file'))
+    stim_file = config_hp.get_attr('inputs', 'thalamus_spikes', 'input_file')
+    stim_file = 'standard_stimulus' if isstandard else os.path.splitext(os.path.split(stim_file)[1])[0]
+    with open(os.path.join(input_path, stim_file + '.json')) as f:
+        stim_setting = json.load(f)
+    stim_params = stim_setting['short' if isbaseline else (stimulus_type if isstandard else 'stim_params')]
+
+    t_start = stim_params['t_start']
+    on_time, off_time = stim_params['on_time'], stim_params['off_time']
+    if isbaseline:
+        windows = np.array([[t_start, t_stop]])
+        on_time, off_time = on_time + off_time, 0.0
+    else:
+        windows = process.get_stim_windows(on_time, off_time, t_start, t_stop)
+
+    setting = dict(
+        trial_name = trial_name, trial_path = trial_path,
+        stimulus_type = stimulus_type, t_start = t_start, t_stop = t_stop,
+        on_time = on_time, off_time = off_time, windows = windows,
+        node_files = config_hp.get_attr('networks', 'nodes'),
+        spike_file = os.path.join(trial_path,
+            os.path.split(config_hp.get_attr('output', 'spikes_file'))[1]),
+        ecp_file = os.path.join(trial_path, 'ecp.h5')
+    )
+    return setting
+
+
+def analyze_trial(setting, node_df, fs=FS, tseg=TSEG,
+                  network_name=NETWORK_NAME):
+    """Summary of spikes and ECP of a trial
+    setting: trial settings from `trial_setting`
+    node_df: nodes dataframe of the network
+    fs: sampling frequency of population spike rate (Hz)
+    tseg: time segment length for PSD (sec)
+    Return: xarray dataset of firing rate of each node, population spike rate,
+        PSD of normalized population spike rate and PSD of LFP (if exists)
+    """
+    t_start, t_stop = setting['t_start'], setting['t_stop']
+    on_time, off_time = setting['on_time'], setting['off_time']
+    pop_ids = get_populations(node_df, pop_names, only_id=True)
+    spikes_df = utils.load_spikes_to_df(setting['spike_file'], network_name)
+
+    # Firing rate of each node during stimulus on time
+    frs = process.firing_rate(spikes_df, num_cells=len(node_df),
+                              time_windows=setting['windows'])
+    frs = xr.DataArray(frs, coords={'node_id': np.arange(len(node_df))})
+    node_pop = node_df['pop_name'].reindex(frs.node_id.values).values
+    pop_fr = [frs[node_pop == p] for p in pop_names]
+
+    # Population spike rate and PSD of normalized spike rate
+    time = np.arange(0, 1000 * t_stop, 1000 / fs)
+    pop_rspk = process.group_spike_rate_to_xarray(
+        spikes_df, time, pop_ids, group_dims='population')
+    spike_rate = pop_rspk.spike_rate
+    spike_rate_std = spike_rate.std(dim='time')
+    spike_rate_norm = (spike_rate - spike_rate.mean(dim='time')) \
+        / spike_rate_std.where(spike_rate_std > 0)
+    f, pxx, _ = process.get_psd_on_stimulus(
+        spike_rate_norm.fillna(0.).values, pop_rspk.fs, on_time, off_time,
+        t_start, t=spike_rate.time, tseg=tseg)
+    psd_rspk = xr.DataArray(pxx, coords={
+        'population': spike_rate.population, 'frequency': f
+    }).where(spike_rate_std > 0)
+
+    summary = xr.Dataset(
+        dict(
+            firing_rate = frs,
+            pop_fr_mean = ('population', [fr.mean().item() for fr in pop_fr]),
+            pop_fr_std = ('population', [fr.std().item() for fr in pop_fr]),
+            spike_rate = spike_rate,
+            population_number = pop_rspk.population_number,
+            psd_spike_rate = psd_rspk
+        ),
+        attrs = {'fs': pop_rspk.fs, 'tseg': tseg}
+    )
+    summary.coords['pop_name'] = ('node_id', node_pop.astype(str))
+
+    if os.path.isfile(setting['ecp_file']):
+        # Lazily loaded ECP reads only stimulus on time
+        lfps = utils.load_ecp_to_xarray(setting['ecp_file'], demean=True, lazy=True)
+        f, pxx, _ = process.get_psd_on_stimulus(
+            lfps, lfps.fs, on_time, off_time, t_start, t=lfps.time, tseg=tseg)
+        summary['psd_lfp'] = xr.DataArray(pxx, coords={
+            'channel_id': lfps.channel_id.values, 'frequency_lfp': f})
+    return summary
+
+
+def analyze_trials(trial_paths, n_workers=1, run_config=RUN_CONFIG,
+                   cache=False, **kwargs):
+    """Analyze multiple trials and combine the summary datasets along dimension
+    `trial`. Nodes are loaded once for trials sharing the same network files.
+    Trials are analyzed in parallel worker processes if n_workers > 1.
+    trial_paths: list of trial paths
+    n_workers: number of worker processes
+    cache: whether load summary of each trial from the result cache in the
+        trial directory if input files and arguments are unchanged
+    kwargs: other arguments for `analyze_trial`
+    Return: combined xarray dataset. Trials that failed are skipped.
+    """
+    global batch_jobs, batch_cache
+    batch_cache = cache
+    node_dfs = {}
+    batch_jobs = []
+    for path in trial_paths:
+        setting = trial_setting(path, run_config=run_config)
+        key = json.dumps(setting['node_files'], sort_keys=True)
+        if key not in node_dfs:
+            node_dfs[key] = load_nodes_from_paths(
+                setting['node_files'])[kwargs.get('network_name', NETWORK_NAME)]
+        batch_jobs.append(dict(setting=setting, node_df=node_dfs[key], **kwargs))
+
+    if n_workers > 1 and len(batch_jobs) > 1:
+        # Workers inherit the nodes by forking
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(min(n_workers, len(batch_jobs))) as pool:
+            summaries = pool.map(analyze_trial_job, range(len(batch_jobs)),
+                                 chunksize=1)
+    else:
+        summaries = [analyze_trial_job(i) for i in range(len(batch_jobs))]
+    settings = [job['setting'] for job in batch_jobs]
+    batch_jobs = []
+
+    valid = [i for i, s in enumerate(summaries) if s is not None]
+    if not valid:
+        raise ValueError("No trial is analyzed successfully.")
+    trial_index = pd.Index([settings[i]['trial_name'] for i in valid], name='trial')
+    summary = xr.concat([summaries[i] for i in valid], dim=trial_index,
+                        data_vars='all', coords='minimal', compat='override',
+                        join='outer', combine_attrs='drop_conflicts')
+    summary.coords['stimulus'] = ('trial', [settings[i]['stimulus_type'] for i in valid])
+    return summary
+
+
+def analyze_trial_job(i):
+    """Analyze a trial in a worker process"""
+    job = batch_jobs[i]
+    setting = job['setting']
+    try:
+        if batch_cache:
+            node_files = [f for nodes in setting['node_files']
+                          for f in nodes.values() if isinstance(f, str)]
+            files = [setting['spike_file'], setting['ecp_file']] + node_files
+            return trial_cache(setting['trial_path']).call(
+                analyze_trial, files=files, skip_args=('node_df', ), **job)
+        return analyze_trial(**job)
+    except Exception as e:
+        print("Skip trial %s: %s" % (setting['trial_name'], e))
+        return None
+
+
+def save_summary(summary, output_file=OUTPUT_FILE):
+    """Save summary dataset into NetCDF file, or Zarr store if the path has
+    extension '.zarr'"""
+    if os.path.splitext(os.path.normpath(output_file))[1] == '.zarr':
+        summary.to_zarr(output_file, mode='w')
+    else:
+        summary.to_netcdf(output_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Analyze simulation results of trials in batch")
+    parser.add_argument('-path', '--result_path', type=str,
+                        nargs='?', default=RESULT_PATH,
+                        help="Path of simulation results", metavar='Result Path')
+    parser.add_argument('-s', '--stimulus', type=str,
+                        nargs="*", default=None,
+                        help="List of stimulus types. Defaults to all types",
+                        metavar='Stimulus')
+    parser.add_argument('-t', '--trials', type=str,
+                        nargs="*", default=None,
+                        help="List of trial paths. Overrides discovery in "
+                        "result path", metavar='Trials')
+    parser.add_argument('-o', '--output', type=str,
+                        nargs='?', default=OUTPUT_FILE,
+                        help="Output NetCDF file or Zarr store (*.zarr)",
+                        metavar='Output')
+    parser.add_argument('-fs', '--fs', type=float,
+                        nargs='?', default=FS,
+                        help="Sampling frequency of population spike rate",
+                        metavar='fs')
+    parser.add_argument('-tseg', '--tseg', type=float,
+                        nargs='?', default=TSEG,
+                        help="Time segment length for PSD", metavar='tseg')
+    parser.add_argument('-w', '--n_workers', type=int, nargs='?',
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', 1)),
+                        help="Number of worker processes for trials",
+                        metavar='# Workers')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help="Reuse cached summary of unchanged trials")
+    args = parser.parse_args()
+
+    trial_paths = args.trials
+    if trial_paths is None:
+        trial_paths = find_trials(args.result_path, stimulus=args.stimulus)
+    print("Analyzing %d trials..." % len(trial_paths))
+    summary = analyze_trials(trial_paths, n_workers=args.n_workers,
+                             cache=args.cache, fs=args.fs, tseg=args.tseg)
+    save_summary(summary, args.output)
+    print("Summary saved to %s" % args.output)
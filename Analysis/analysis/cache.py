@@ -0,0 +1,286 @@
+import os
+import json
+import glob
+import hashlib
+import inspect
+import types
+import functools
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+CACHE_DIR = 'analysis_cache'  # cache directory name under trial directory
+MAX_CACHE_SIZE = 2 ** 30  # bytes. Default size limit of a cache directory
+
+
+def hash_value(value, h=None):
+    """Update hash object with the content of a value. Supports arrays,
+    pandas and xarray objects, and nested lists, tuples and dicts of them.
+    Other values are hashed by their repr.
+    """
+    if h is None:
+        h = hashlib.blake2b(digest_size=16)
+    if isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        if value.dtype.hasobject:
+            h.update(repr(value.tolist()).encode())
+        else:
+            h.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        h.update(repr(type(value).__name__).encode())
+        if isinstance(value, pd.DataFrame):
+            hash_value(list(value.columns), h)
+        hash_value(pd.util.hash_pandas_object(value).values, h)
+    elif isinstance(value, xr.DataArray):
+        hash_value((value.name, value.dims, value.attrs), h)
+        hash_value(value.values, h)
+        hash_value({k: v.variable.values for k, v in value.coords.items()}, h)
+    elif isinstance(value, xr.Dataset):
+        hash_value(value.attrs, h)
+        hash_value({k: (v.dims, v.values) for k, v in value.variables.items()}, h)
+    elif isinstance(value, (list, tuple)):
+        h.update(('%s%d' % (type(value).__name__, len(value))).encode())
+        for v in value:
+            hash_value(v, h)
+    elif isinstance(value, dict):
+        h.update(('dict%d' % len(value)).encode())
+        for k in sorted(value, key=repr):
+            hash_value(k, h)
+            hash_value(value[k], h)
+    elif isinstance(value, functools.partial):
+        hash_value((value.func, value.args, value.keywords), h)
+    elif isinstance(value, types.CodeType):
+        h.update(value.co_code)
+        hash_value(value.co_consts, h)
+    elif callable(value) and hasattr(value, '__qualname__'):
+        # Functions by name and code, since repr includes the memory address
+        h.update(('%s.%s' % (getattr(value, '__module__', None),
+                             value.__qualname__)).encode())
+        if hasattr(value, '__code__'):
+            hash_value(value.__code__, h)
+    else:
+        h.update(repr(value).encode())
+    return h
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash(file, mtime_ns):
+    """Hash of the content of a file at modification time"""
+    with open(file, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def source_hash(*files):
+    """Hash of the content of source files, the analysis package modules
+    by default. Files are read again only when modified."""
+    if not files:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        files = sorted(glob.glob(os.path.join(package_dir, '*.py')))
+    h = hashlib.blake2b(digest_size=16)
+    for file in files:
+        h.update(_file_hash(file, os.stat(file).st_mtime_ns).encode())
+    return h.hexdigest()
+
+
+def _encode_result(result, arrays):
+    """Encode nested tuples, lists and dicts of arrays or scalars into a json
+    structure and a dictionary of arrays for npz file"""
+    if isinstance(result, (tuple, list)):
+        return {'type': type(result).__name__,
+                'items': [_encode_result(r, arrays) for r in result]}
+    if isinstance(result, dict):
+        if not all(isinstance(k, str) for k in result):
+            raise TypeError("Only dict with str keys can be cached.")
+        return {'type': 'dict', 'keys': list(result),
+                'items': [_encode_result(r, arrays) for r in result.values()]}
+    if result is None or isinstance(result, (str, bool, int, float)):
+        return {'type': 'value', 'value': result}
+    if not isinstance(result, (np.ndarray, np.generic)) or result.dtype.hasobject:
+        raise TypeError("Result of type %s cannot be cached." % type(result))
+    key = 'arr_%d' % len(arrays)
+    arrays[key] = np.asarray(result)
+    return {'type': 'array', 'key': key, 'scalar': isinstance(result, np.generic)}
+
+
+def _decode_result(struct, arrays):
+    """Decode result from json structure and arrays of npz file"""
+    if struct['type'] == 'value':
+        return struct['value']
+    if struct['type'] == 'array':
+        array = arrays[struct['key']]
+        return array[()] if struct['scalar'] else array
+    items = [_decode_result(s, arrays) for s in struct['items']]
+    if struct['type'] == 'dict':
+        return dict(zip(struct['keys'], items))
+    return tuple(items) if struct['type'] == 'tuple' else items
+
+
+class ResultCache(object):
+    """On-disk cache of analysis results. Results are keyed on the signature
+    of input files (size and modification time, or content hash), the
+    function and its arguments, and the source of the analysis package and
+    the module of the function. xarray results are stored as NetCDF files,
+    others (arrays, scalars and nested tuples, lists, dicts of them) as npz
+    files. Least recently used results are evicted when the total size of the
+    cache directory exceeds the limit.
+    """
+    _file_hashes = {}  # content hash of files by (path, size, mtime)
+
+    def __init__(self, cache_dir, max_size=MAX_CACHE_SIZE, hash_content=False):
+        """
+        cache_dir: directory of cache files
+        max_size: size limit (bytes) of the cache directory
+        hash_content: whether key files on content hash. If False, key files
+            on size and modification time, which needs no reading.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hash_content = hash_content
+
+    def file_signature(self, file, chunk_size=2 ** 24):
+        """Signature of a file that changes when the file is modified"""
+        file = os.path.abspath(file)
+        if not os.path.isfile(file):
+            return file, None
+        stat = os.stat(file)
+        sig = (file, stat.st_size, stat.st_mtime_ns)
+        if not self.hash_content:
+            return sig
+        if sig not in self._file_hashes:
+            h = hashlib.blake2b(digest_size=16)
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    h.update(chunk)
+            self._file_hashes[sig] = h.hexdigest()
+        return file, self._file_hashes[sig]
+
+    def key(self, func, args=(), kwargs={}, files=(), skip_args=()):
+        """Cache key of a function call
+        func: function to call
+        args, kwargs: arguments of the function
+        files: input files the result depends on
+        skip_args: names of arguments excluded from the key, e.g. data loaded
+            from the input files, which are already keyed by `files`.
+        """
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {k: v for k, v in bound.arguments.items()
+                     if k not in skip_args}
+        # Results change with the code of the function and any function of
+        # the analysis package it calls, so key on the source of the package
+        # and the module of the function
+        h = hash_value(func)
+        h.update(source_hash().encode())
+        try:
+            module_file = inspect.getsourcefile(func)
+        except TypeError:
+            module_file = None
+        if module_file is not None:
+            h.update(source_hash(module_file).encode())
+        hash_value([self.file_signature(f) for f in files], h)
+        hash_value(arguments, h)
+        return h.hexdigest()
+
+    def _find(self, key):
+        files = [f for f in glob.glob(os.path.join(self.cache_dir, key + '.*'))
+                 if not f.endswith('.tmp')]
+        return files[0] if files else None
+
+    def load(self, key):
+        """Load cached result
+        Return: whether result is found, result
+        """
+        file = self._find(key)
+        if file is None:
+            return False, None
+        kind = file.split('.')[-2] if file.endswith('.nc') else 'npz'
+        try:
+            if kind == 'dataset':
+                result = xr.load_dataset(file)
+            elif kind == 'dataarray':
+                result = xr.load_dataarray(file)
+            else:
+                with np.load(file) as f:
+                    arrays = {k: f[k] for k in f.files}
+                result = _decode_result(
+                    json.loads(arrays.pop('structure').item()), arrays)
+        except Exception as e:
+            print("Failed to load cache file %s: %s" % (file, e))
+            return False, None
+        os.utime(file)  # mark as recently used
+        return True, result
+
+    def save(self, key, result):
+        """Save result into cache and evict least recently used results"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, key)
+        tmp_file = path + '.%d.tmp' % os.getpid()
+        try:
+            if isinstance(result, xr.Dataset):
+                file = path + '.dataset.nc'
+                result.to_netcdf(tmp_file)
+            elif isinstance(result, xr.DataArray):
+                file = path + '.dataarray.nc'
+                result.to_netcdf(tmp_file)
+            else:
+                file = path + '.npz'
+                arrays = {}
+                struct = json.dumps(_encode_result(result, arrays))
+                with open(tmp_file, 'wb') as f:
+                    np.savez(f, structure=np.array(struct), **arrays)
+            # Atomic so that concurrent processes never read partial files
+            os.replace(tmp_file, file)
+        except Exception as e:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            print("Result not cached: %s" % e)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used cache files until within size limit"""
+        files = [os.path.join(self.cache_dir, f)
+                 for f in os.listdir(self.cache_dir) if not f.endswith('.tmp')]
+        stats = [os.stat(f) for f in files]
+        total = sum(s.st_size for s in stats)
+        for i in np.argsort([s.st_mtime_ns for s in stats]):
+            if total <= self.max_size:
+                break
+            os.remove(files[i])
+            total -= stats[i].st_size
+
+    def clear(self):
+        """Remove all cache files"""
+        if os.path.isdir(self.cache_dir):
+            for f in os.listdir(self.cache_dir):
+                os.remove(os.path.join(self.cache_dir, f))
+
+    def call(self, func, *args, files=(), skip_args=(), **kwargs):
+        """Call function with arguments, or load result from cache
+        files: input files the result depends on
+        skip_args: names of arguments excluded from the cache key
+        """
+        key = self.key(func, args, kwargs, files=files, skip_args=skip_args)
+        found, result = self.load(key)
+        if not found:
+            result = func(*args, **kwargs)
+            self.save(key, result)
+        return result
+
+    def cached(self, func, files=(), skip_args=()):
+        """Wrap function so that its results are cached
+        files: input files the result depends on
+        skip_args: names of arguments excluded from the cache key
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, files=files,
+                             skip_args=skip_args, **kwargs)
+        return wrapper
+
+
+def trial_cache(trial_path, **kwargs):
+    """Result cache in the directory of a trial
+    kwargs: arguments for `ResultCache`
+    """
+    return ResultCache(os.path.join(trial_path, CACHE_DIR), **kwargs)
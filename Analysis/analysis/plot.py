@@ -9,6 +9,7 @@ import pywt
 from fooof import FOOOF
 from fooof.sim.gen import gen_aperiodic, gen_model
 from matplotlib.patches import FancyArrowPatch, ArrowStyle
+from matplotlib.colors import to_rgba
 from build_input import get_populations
 from analysis import utils, process
 
@@ -19,16 +20,47 @@ pop_color = {p: 'tab:' + clr for p, clr in pop_color_base.items()}
 pop_names = list(pop_color.keys())
 
 
-def raster(pop_spike, pop_color, id_column='node_ids', s=0.01, ax=None):
+def raster(pop_spike, pop_color, id_column='node_ids', s=0.01, ax=None,
+           rasterize=False, n_columns=None, n_rows=None):
+    """Spike raster plot
+    pop_spike: dictionary of spike dataframes of each population
+    pop_color: dictionary of color of each population
+    id_column: column of cell ids used as y-axis
+    s: marker size of scatter plot
+    rasterize: whether bin spikes into an image of cell rows by time columns
+        and draw with imshow instead of a marker for each spike
+    n_columns: number of time columns of the image. Defaults to the width of
+        the axis in pixels.
+    n_rows: maximum number of cell rows of the image. Defaults to the height
+        of the axis in pixels.
+    """
     if ax is None:
         _, ax = plt.subplots(1, 1)
     ymin, ymax = [], []
-    for p, spike_df in pop_spike.items():
-        if len(spike_df) > 0:
-            ids = spike_df[id_column].values
-            ax.scatter(spike_df['timestamps'], ids, c=pop_color[p], s=s, label=p)
-            ymin.append(ids.min())
-            ymax.append(ids.max())
+    if rasterize:
+        bbox = ax.get_window_extent()
+        if n_columns is None:
+            n_columns = max(int(np.ceil(bbox.width)), 1)
+        if n_rows is None:
+            n_rows = max(int(np.ceil(bbox.height)), 1)
+        img, extent = raster_image(pop_spike, pop_color, id_column=id_column,
+                                   n_columns=n_columns, n_rows=n_rows)
+        if img is not None:
+            ax.imshow(img, extent=extent, origin='lower', aspect='auto',
+                      interpolation='nearest')
+            ymin.append(extent[2] + 0.5)
+            ymax.append(extent[3] - 0.5)
+        for p, spike_df in pop_spike.items():
+            if len(spike_df) > 0:
+                # Empty artists for legend
+                ax.scatter([], [], c=pop_color[p], marker='s', label=p)
+    else:
+        for p, spike_df in pop_spike.items():
+            if len(spike_df) > 0:
+                ids = spike_df[id_column].values
+                ax.scatter(spike_df['timestamps'], ids, c=pop_color[p], s=s, label=p)
+                ymin.append(ids.min())
+                ymax.append(ids.max())
     ax.set_xlim(left=0.)
     ax.set_ylim([np.min(ymin) - 1, np.max(ymax) + 1])
     ax.set_title('Spike Raster Plot')
@@ -38,6 +70,50 @@ def raster(pop_spike, pop_color, id_column='node_ids', s=0.01, ax=None):
     return ax
 
 
+def raster_image(pop_spike, pop_color, id_column='node_ids', n_columns=1000,
+                 n_rows=None, t_range=None):
+    """Bin spikes into RGBA image of cell rows and time columns. Pixels with
+    any spike take the color of the population. Populations later in the
+    dictionary are drawn over earlier ones if pixels overlap.
+    pop_spike: dictionary of spike dataframes of each population
+    pop_color: dictionary of color of each population
+    id_column: column of cell ids used as rows
+    n_columns: number of time columns
+    n_rows: maximum number of rows. If there are more cells, consecutive cell
+        ids are binned into rows, so that no cell is dropped when the image
+        is drawn on fewer pixels. Defaults to a row for each cell.
+    t_range: time range (ms) of the image. Defaults to 0 to the last spike.
+    Return: image array (row, time, RGBA), extent for imshow
+        Image is None if there is no spike.
+    """
+    pop_spike = {p: df for p, df in pop_spike.items() if len(df) > 0}
+    if not pop_spike:
+        return None, None
+    ids = {p: df[id_column].values.astype(int) for p, df in pop_spike.items()}
+    id_min = min(i.min() for i in ids.values())
+    n_ids = max(i.max() for i in ids.values()) - id_min + 1
+    n_rows = n_ids if n_rows is None else min(max(n_rows, 1), n_ids)
+    if t_range is None:
+        t_range = (0., max(df['timestamps'].max() for df in pop_spike.values()))
+    t0, t1 = t_range
+    if t1 <= t0:
+        t1 = t0 + 1.
+    dt = (t1 - t0) / n_columns
+
+    img = np.zeros((n_rows * n_columns, 4), dtype=np.float32)
+    for p, df in pop_spike.items():
+        col = ((df['timestamps'].values - t0) / dt).astype(int)
+        col[col == n_columns] = n_columns - 1  # include the right edge
+        valid = (col >= 0) & (col < n_columns)
+        row = (ids[p][valid] - id_min) * n_rows // n_ids
+        count = np.bincount(row * n_columns + col[valid],
+                            minlength=n_rows * n_columns)
+        img[count > 0] = to_rgba(pop_color[p])
+    img = img.reshape(n_rows, n_columns, 4)
+    extent = (t0, t1, id_min - 0.5, id_min + n_ids - 0.5)
+    return img, extent
+
+
 def firing_rate_histogram(pop_fr, pop_color, bins=30, min_fr=None,
                           logscale=False, stacked=True, ax=None):
     if logscale and min_fr is not None:
@@ -227,8 +303,13 @@ CMOR_FLAMBDA = 4 * np.pi / (f0 + (2 + f0 ** 2) ** 0.5)
 COI_FREQ = 1 / (CMOR_COI * CMOR_FLAMBDA)
 
 def cwt_spectrogram(x, fs, nNotes=6, nOctaves=np.inf, freq_range=(0, np.inf),
-                    bandwidth=1.0, axis=-1, detrend=False, normalize=False):
-    """Calculate spectrogram using continuous wavelet transform"""
+                    bandwidth=1.0, axis=-1, detrend=False, normalize=False,
+                    use_fft=True, dtype=np.float32, chunk_size=None):
+    """Calculate spectrogram using continuous wavelet transform
+    use_fft: whether use FFT convolution with cached wavelet bank instead of
+        pywt.cwt. Power and cone of influence are returned in `dtype`.
+    chunk_size: number of channels in each chunk when using FFT
+    """
     x = np.asarray(x)
     N = x.shape[axis]
     times = np.arange(N) / fs
@@ -249,12 +330,20 @@ def cwt_spectrogram(x, fs, nNotes=6, nOctaves=np.inf, freq_range=(0, np.inf),
     wavelet = 'cmor' + str(2 * bandwidth ** 2) + '-1.0'
     frequencies = pywt.scale2frequency(wavelet, scales) * fs
     scales = scales[(frequencies >= freq_range[0]) & (frequencies <= freq_range[1])]
-    coef, frequencies = pywt.cwt(x, scales[::-1], wavelet=wavelet, sampling_period=1 / fs, axis=axis)
-    power = np.real(coef * np.conj(coef)) # equivalent to power = np.abs(coef)**2
+    if use_fft:
+        frequencies = fs / scales[::-1]
+        power = process.cwt_fft(x, scales[::-1], bandwidth=bandwidth, axis=axis,
+                                dtype=dtype, chunk_size=chunk_size,
+                                func=lambda c: np.real(c * np.conj(c)))
+    else:
+        coef, frequencies = pywt.cwt(x, scales[::-1], wavelet=wavelet, sampling_period=1 / fs, axis=axis)
+        power = np.real(coef * np.conj(coef)) # equivalent to power = np.abs(coef)**2
     # cone of influence in terms of wavelength
     coi = N / 2 - np.abs(np.arange(N) - (N - 1) / 2)
     # cone of influence in terms of frequency
     coif = COI_FREQ * fs / coi
+    if use_fft:
+        coif = coif.astype(dtype)
     return power, times, frequencies, coif
 
 
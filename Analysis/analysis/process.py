@@ -1,9 +1,13 @@
+import functools
 import numpy as np
 import pandas as pd
 import xarray as xr
 import scipy.signal as ss
+import scipy.sparse as sps
+import scipy.fft as sfft
 import pywt
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import gaussian_filter1d
+from numpy.lib.stride_tricks import as_strided
 
 from build_input import get_stim_cycle, T_STOP
 
@@ -32,24 +36,26 @@ def get_stim_cycle_dict(fs, on_time, off_time, t_start, t_stop=T_STOP):
     return stim_cycle
 
 
-def get_seg_on_stimulus(x, fs, on_time, off_time,
-                        t_start, t=T_STOP, tseg=None):
-    """Convert input time series during stimulus on time into time segments
-    x: input 1d-array or 2d-array where time is the last axis
+def get_seg_stack_on_stimulus(x, fs, on_time, off_time,
+                              t_start, t=T_STOP, tseg=None):
+    """Stack time segments of input time series during stimulus on time
+    x: input array where time is the last axis
+        If x is a lazily loaded DataArray, only stimulus on time is loaded.
     fs: sampling frequency (Hz)
     on_time, off_time: on / off time durations
     t_start, t: start and stop time of the stimulus cycles
         If t is an array of time points, the array size is used to infer stop time
     tseg: time segment length. Defaults to on_time if not specified
     Return:
-        x_on: same number of dimensions as input, time segments concatenated
+        x_seg: array of shape (..., segment, nfft). If on time of each cycle
+            divides into whole segments within the input, it is a read-only
+            strided view of the input (copied only if there are multiple
+            segments per cycle). Otherwise, partial segments are zero padded.
         nfft: number of time steps per segment
         stim_cycle: parameters of stimulus cycles
     """
-    x = np.asarray(x)
-    in_dim = x.ndim
-    if in_dim == 1:
-        x = x.reshape(1, x.size)
+    if not isinstance(x, xr.DataArray):
+        x = np.asarray(x)
     t = np.asarray(t)
     t_stop = t.size / fs if t.ndim else t
     if tseg is None:
@@ -59,36 +65,97 @@ def get_seg_on_stimulus(x, fs, on_time, off_time,
     nfft = int(tseg * fs) # steps per segment
     i_on = int(on_time * fs)
     nseg_cycle = int(np.ceil(i_on / nfft))
-    x_on = np.zeros((x.shape[0], stim_cycle['n_cycle'] * nseg_cycle * nfft))
+    n_on = nseg_cycle * nfft  # on time steps padded to whole segments
+    n_cycle = stim_cycle['n_cycle']
     i_start, i_cycle = stim_cycle['i_start'], stim_cycle['i_cycle']
+    n_steps = x.shape[-1]
+
+    if isinstance(x, xr.DataArray):
+        # Load only stimulus on time of each cycle
+        x_cycle = np.zeros(x.shape[:-1] + (n_cycle, n_on))
+        for i in range(n_cycle):
+            m = i_start + i * i_cycle
+            xx = np.asarray(x[..., m:m + i_on])
+            x_cycle[..., i, :xx.shape[-1]] = xx
+    elif n_on == i_on and n_cycle and \
+            i_start + (n_cycle - 1) * i_cycle + n_on <= n_steps:
+        # View of cycles with stride of cycle length
+        x_cycle = as_strided(x[..., i_start:], writeable=False,
+            shape=x.shape[:-1] + (n_cycle, n_on),
+            strides=x.strides[:-1] + (i_cycle * x.strides[-1], x.strides[-1]))
+    else:
+        idx = i_start + i_cycle * np.arange(n_cycle)[:, None] + np.arange(n_on)
+        valid = (np.arange(n_on) < i_on) & (idx < n_steps)
+        x_cycle = np.where(valid, x[..., np.where(valid, idx, 0)], 0.)
+    x_seg = x_cycle.reshape(x_cycle.shape[:-2] + (n_cycle * nseg_cycle, nfft))
+    return x_seg, nfft, stim_cycle
 
-    for i in range(stim_cycle['n_cycle']):
-        m = i_start + i * i_cycle
-        for j in range(nseg_cycle):
-            xx = x[:, m + j * nfft:m + min((j + 1) * nfft, i_on)]
-            n = (i * nseg_cycle + j) * nfft
-            x_on[:, n:n + xx.shape[1]] = xx
-    if in_dim == 1:
-        x_on = x_on.ravel()
+
+def get_seg_on_stimulus(x, fs, on_time, off_time,
+                        t_start, t=T_STOP, tseg=None):
+    """Convert input time series during stimulus on time into time segments
+    x: input 1d-array or 2d-array where time is the last axis
+        If x is a lazily loaded DataArray, only stimulus on time is loaded.
+    fs: sampling frequency (Hz)
+    on_time, off_time: on / off time durations
+    t_start, t: start and stop time of the stimulus cycles
+        If t is an array of time points, the array size is used to infer stop time
+    tseg: time segment length. Defaults to on_time if not specified
+    Return:
+        x_on: same number of dimensions as input, time segments concatenated
+        nfft: number of time steps per segment
+        stim_cycle: parameters of stimulus cycles
+    """
+    x_seg, nfft, stim_cycle = get_seg_stack_on_stimulus(
+        x, fs, on_time, off_time, t_start, t=t, tseg=tseg)
+    x_on = x_seg.reshape(x_seg.shape[:-2] + (-1, ))
     return x_on, nfft, stim_cycle
 
 
+def psd_seg_stack(x_seg, fs):
+    """PSD by averaging periodograms of stacked time segments, the same as
+    Welch's method with boxcar window and no overlap between segments
+    x_seg: array of shape (..., segment, nfft)
+    fs: sampling frequency (Hz)
+    Return: frequencies, PSD of shape (..., frequency)
+    """
+    f, pxx = ss.periodogram(x_seg, fs=fs, window='boxcar', axis=-1)
+    return f, pxx.mean(axis=-2)
+
+
+def coh_seg_stack(x_seg, y_seg, fs):
+    """Coherence from stacked time segments of two signals, the same as
+    scipy.signal.coherence with boxcar window and no overlap between segments
+    x_seg, y_seg: arrays of shape (..., segment, nfft)
+    fs: sampling frequency (Hz)
+    Return: frequencies, coherence of shape (..., frequency)
+    """
+    x_fft = np.fft.rfft(ss.detrend(x_seg, type='constant', axis=-1), axis=-1)
+    y_fft = np.fft.rfft(ss.detrend(y_seg, type='constant', axis=-1), axis=-1)
+    pxx = np.mean(np.abs(x_fft) ** 2, axis=-2)
+    pyy = np.mean(np.abs(y_fft) ** 2, axis=-2)
+    pxy = np.mean(np.conj(x_fft) * y_fft, axis=-2)
+    f = np.fft.rfftfreq(x_seg.shape[-1], d=1 / fs)
+    return f, np.abs(pxy) ** 2 / pxx / pyy
+
+
 def get_psd_on_stimulus(x, fs, on_time, off_time,
                         t_start, t=T_STOP, tseg=None, axis=-1):
-    x_on, nfft, stim_cycle = get_seg_on_stimulus(
+    if not isinstance(x, xr.DataArray):
+        x = np.moveaxis(np.asarray(x), axis, -1)
+    x_seg, nfft, stim_cycle = get_seg_stack_on_stimulus(
         x, fs, on_time, off_time, t_start, t=t, tseg=tseg)
-    f, pxx = ss.welch(x_on, fs=fs, window='boxcar',
-                      nperseg=nfft, noverlap=0, axis=axis)
+    f, pxx = psd_seg_stack(x_seg, fs)
     return f, pxx, stim_cycle
 
 
 def get_coh_on_stimulus(x, y, fs, on_time, off_time,
                         t_start, t=T_STOP, tseg=None):
-    xy = np.array([x, y])
-    xy_on, nfft, _ = get_seg_on_stimulus(
-        xy, fs, on_time, off_time, t_start, t=t, tseg=tseg)
-    f, cxy = ss.coherence(xy_on[0], xy_on[1], fs=fs,
-        window='boxcar', nperseg=nfft, noverlap=0)
+    x_seg, nfft, _ = get_seg_stack_on_stimulus(
+        x, fs, on_time, off_time, t_start, t=t, tseg=tseg)
+    y_seg, _, _ = get_seg_stack_on_stimulus(
+        y, fs, on_time, off_time, t_start, t=t, tseg=tseg)
+    f, cxy = coh_seg_stack(x_seg, y_seg, fs)
     return f, cxy
 
 
@@ -100,24 +167,40 @@ def firing_rate(spikes_df, num_cells=None, time_windows=(0.,), frequency=True):
     time_windows: list of time windows for counting spikes (second)
     frequency: whether return firing frequency in Hz or just number of spikes
     """
-    if not spikes_df['timestamps'].is_monotonic_increasing:
-        spikes_df = spikes_df.sort_values(by='timestamps')
+    return firing_rate_sets(spikes_df, num_cells=num_cells,
+        window_sets=[time_windows], frequency=frequency)[0]
+
+
+def firing_rate_sets(spikes_df, num_cells=None, window_sets=((0.,),),
+                     frequency=True):
+    """
+    Count number of spikes for each cell in each of multiple sets of windows.
+    spikes_df: dataframe of node id and spike times (ms)
+    num_cells: number of cells (that determines maximum node id)
+    window_sets: list of sets of time windows for counting spikes (second)
+        Each set is a list of time windows as in `firing_rate`.
+    frequency: whether return firing frequency in Hz or just number of spikes
+    Return: 2d-array, each row is for a set of time windows
+    """
+    timestamps = spikes_df['timestamps'].values
+    node_ids = spikes_df['node_ids'].values.astype(int)
     if num_cells is None:
-        num_cells = spikes_df['node_ids'].max() + 1
-    time_windows = 1000. * np.asarray(time_windows).ravel()
-    if time_windows.size % 2:
-        time_windows = np.append(time_windows, spikes_df['timestamps'].max())
-    nspk = np.zeros(num_cells, dtype=int)
-    n, N = 0, time_windows.size
-    count = False
-    for t, i in zip(spikes_df['timestamps'], spikes_df['node_ids']):
-        while n < N and t > time_windows[n]:
-            n += 1
-            count = not count
-        if count:
-            nspk[i] = nspk[i] + 1
-    if frequency:
-        nspk = nspk / (total_duration(time_windows) / 1000)
+        num_cells = node_ids.max() + 1 if node_ids.size else 0
+    elif node_ids.size and node_ids.max() >= num_cells:
+        raise ValueError("Node ids in spikes exceed `num_cells`.")
+    nspk = np.zeros((len(window_sets), num_cells),
+                    dtype=float if frequency else int)
+    for k, time_windows in enumerate(window_sets):
+        time_windows = 1000. * np.asarray(time_windows).ravel()
+        if time_windows.size % 2:
+            time_windows = np.append(time_windows,
+                timestamps.max() if timestamps.size else time_windows[-1])
+        # Spikes within (start, end] of windows are after odd number of edges
+        in_window = np.searchsorted(time_windows, timestamps) % 2 == 1
+        count = np.bincount(node_ids[in_window], minlength=num_cells)
+        if frequency:
+            count = count / (total_duration(time_windows) / 1000)
+        nspk[k] = count
     return nspk
 
 
@@ -145,6 +228,42 @@ def pop_spike_rate(spike_times, time=None, time_points=None, frequeny=False):
     return spike_rate
 
 
+def group_spike_histogram(spikes_df, bins, group_ids):
+    """Count spike histogram of multiple neuron groups in a single pass
+    spikes_df: dataframe of node ids and spike times (ms)
+    bins: edges of time bins (ms). The last bin includes the right edge.
+    group_ids: list of node ids in each group. Groups may overlap.
+    Return: 2d-array of spike counts (groups-by-time bins)
+    """
+    bins = np.asarray(bins)
+    n_bins, n_groups = bins.size - 1, len(group_ids)
+    # Sparse membership matrix (nodes-by-groups)
+    node_ids = [np.asarray(ids, dtype=int).ravel() for ids in group_ids]
+    group_idx = np.repeat(np.arange(n_groups), [ids.size for ids in node_ids])
+    node_ids = np.concatenate([np.zeros(0, dtype=int)] + node_ids)
+    n_nodes = node_ids.max() + 1 if node_ids.size else 0
+    membership = sps.csr_matrix(
+        (np.ones(node_ids.size, dtype=bool), (node_ids, group_idx)),
+        shape=(n_nodes, n_groups))
+
+    # Time bin index of each spike, same as np.histogram
+    timestamps = spikes_df['timestamps'].values
+    spk_nodes = spikes_df['node_ids'].values.astype(int)
+    t_idx = np.searchsorted(bins, timestamps, side='right') - 1
+    t_idx[timestamps == bins[-1]] = n_bins - 1
+    valid = (t_idx >= 0) & (t_idx < n_bins) & (spk_nodes < n_nodes)
+    t_idx, spk_nodes = t_idx[valid], spk_nodes[valid]
+
+    # Expand each spike to all groups its node belongs to
+    start = membership.indptr[spk_nodes]
+    n_memb = membership.indptr[spk_nodes + 1] - start
+    memb_idx = np.repeat(start - np.cumsum(n_memb) + n_memb, n_memb)
+    spk_groups = membership.indices[memb_idx + np.arange(n_memb.sum())]
+    counts = np.bincount(spk_groups * n_bins + np.repeat(t_idx, n_memb),
+                         minlength=n_groups * n_bins)
+    return counts.reshape(n_groups, n_bins)
+
+
 def group_spike_rate_to_xarray(spikes_df, time, group_ids,
                                group_dims=['assembly', 'population']):
     """Convert spike times into spike rate of neuron groups in xarray dataset
@@ -159,16 +278,17 @@ def group_spike_rate_to_xarray(spikes_df, time, group_ids,
         group_dims = [group_dims]
         group_ids = {(k, ): v for k, v in group_ids.items()}
     group_index = pd.MultiIndex.from_tuples(group_ids, names=group_dims)
+    dt = (time[-1] - time[0]) / (time.size - 1)
+    bins = np.append(time, time[-1] + dt)
+    population_number = np.array([len(ids) for ids in group_ids.values()])
+    spike_rate = 1000 / dt * group_spike_histogram(
+        spikes_df, bins, list(group_ids.values()))
     grp_rspk = xr.Dataset(
         dict(
             spike_rate = (
-                ['group', 'time'],
-                [pop_spike_rate(
-                    spikes_df.loc[spikes_df['node_ids'].isin(ids), 'timestamps'],
-                    time_points=time,  frequeny=True
-                ) / len(ids) for ids in group_ids.values()]
+                ['group', 'time'], spike_rate / population_number[:, None]
             ),
-            population_number = ('group', [len(ids) for ids in group_ids.values()])
+            population_number = ('group', population_number)
         ),
         coords = {'group': group_index, 'time': time + 1000 / fs / 2},
         attrs = {'fs': fs}
@@ -176,33 +296,57 @@ def group_spike_rate_to_xarray(spikes_df, time, group_ids,
     return grp_rspk
 
 
-def unit_spike_rate_to_xarray(spikes_df, time, node_ids,
-                              frequeny=False, filt_sigma=0.):
+def unit_spike_rate_to_xarray(spikes_df, time, node_ids, frequeny=False,
+                              filt_sigma=0., sparse=False, dtype=None,
+                              chunk_size=256):
     """Count units spike histogram
     spikes_df: dataframe of node ids and spike times
     time: tuple of (start, stop, step) (ms)
     node_ids: list of id of nodes considered
     frequeny: whether return spike frequency in Hz or count
     filt_sigma: sigma (ms) of Gaussian filter for smoothing
+    sparse: whether return scipy sparse matrix (CSR). Ignored if smoothing.
+    dtype: data type of returned array, e.g. uint8 or int16 for counts without
+        smoothing to reduce memory. Defaults to float.
+    chunk_size: number of units in each chunk when converting to dense array
+        and smoothing, which bounds the memory of intermediate results.
     Return: 2D spike time histogram (node_ids-by-times)
     """
-    idx = np.argsort(node_ids)
-    node_ids_sort = np.asarray(node_ids)[idx]
-    idx_inv = np.zeros_like(idx)
-    idx_inv[idx] = range(idx.size)
-    spikes_df = spikes_df.loc[spikes_df['node_ids'].isin(node_ids_sort)]
+    node_ids = np.asarray(node_ids)
     time = np.asarray(time)
     dt = (time[-1] - time[0]) / (time.size - 1)
     t_bins = np.append(time, time[-1] + 1/dt)
-    n_bins = np.append(node_ids_sort, node_ids_sort[-1])
-    spike_rate, _, _ = np.histogram2d(
-        spikes_df['node_ids'], spikes_df['timestamps'], bins=(n_bins, t_bins))
-    spike_rate = spike_rate[idx_inv, :]
-    if frequeny:
-        spike_rate = 1000 / dt * spike_rate
-    if filt_sigma:
-        filt_sigma = (0, filt_sigma / dt)
-        spike_rate = gaussian_filter(spike_rate, filt_sigma)
+    n_times = time.size
+
+    # Row index of units and column index of time bins for each spike
+    idx = np.argsort(node_ids)
+    node_ids_sort = node_ids[idx]
+    timestamps = spikes_df['timestamps'].values
+    spk_nodes = spikes_df['node_ids'].values
+    row = np.searchsorted(node_ids_sort, spk_nodes)
+    valid = row < node_ids.size
+    valid[valid] = node_ids_sort[row[valid]] == spk_nodes[valid]
+    col = np.searchsorted(t_bins, timestamps, side='right') - 1
+    col[timestamps == t_bins[-1]] = n_times - 1
+    valid &= (col >= 0) & (col < n_times)
+    spike_count = sps.csr_matrix(
+        (np.ones(np.count_nonzero(valid), dtype=np.int32),
+         (idx[row[valid]], col[valid])), shape=(node_ids.size, n_times))
+    spike_count.sum_duplicates()
+
+    scale = 1000 / dt if frequeny else 1
+    if sparse and not filt_sigma:
+        return spike_count * scale if frequeny else spike_count
+
+    dtype = float if dtype is None else dtype
+    spike_rate = np.empty(spike_count.shape, dtype=dtype)
+    for i in range(0, node_ids.size, chunk_size):
+        rate = spike_count[i:i + chunk_size].toarray().astype(float)
+        if frequeny:
+            rate = scale * rate
+        if filt_sigma:
+            rate = gaussian_filter1d(rate, filt_sigma / dt, axis=1)
+        spike_rate[i:i + chunk_size] = rate
     return spike_rate
 
 
@@ -318,11 +462,174 @@ def wave_cwt(x, freq, fs, bandwidth=1.0, axis=-1):
     return x_a
 
 
-def get_waves(da, fs, waves, transform, dim='time', component='amp', **kwargs):
-    x = [xr.zeros_like(da) for _ in range(len(waves))]
+def butter_band_gain(freq_band, fs, freqs, filt_order=2):
+    """Gain of zero-phase (forward-backward) Butterworth bandpass filter
+    freq_band: (low, high) cutoff frequencies (Hz)
+    fs: sampling frequency (Hz)
+    freqs: frequencies (Hz) at which to evaluate the gain
+    """
+    sos = ss.butter(N=filt_order, Wn=freq_band, btype='bandpass',
+                    fs=fs, output='sos')
+    _, h = ss.sosfreqz(sos, worN=freqs, fs=fs)
+    return np.abs(h) ** 2
+
+
+def cmor_fft_kernel(scale, n_fft, bandwidth=1.0):
+    """Fourier transform of complex Morlet wavelet 'cmor{2*bandwidth^2}-1.0' at
+    scale (in time steps) on non-negative FFT frequencies of length n_fft.
+    It includes the first difference response of the integrated wavelet in
+    pywt.cwt, so that the convolution matches pywt.cwt coefficients.
+    """
+    f = np.fft.rfftfreq(n_fft)  # cycles per time step
+    kernel = np.sqrt(scale) * np.exp(-2 * (np.pi * bandwidth) ** 2
+                                     * (scale * f - 1) ** 2).astype(complex)
+    kernel[1:] *= (1 - np.exp(-2j * np.pi * f[1:])) / (2j * np.pi * f[1:])
+    return kernel
+
+
+@functools.lru_cache(maxsize=2)
+def cmor_wavelet_bank(scales, n_fft, bandwidth=1.0, dtype=np.complex128):
+    """Cached bank of complex Morlet wavelets in frequency domain. Only the
+    most recent banks are kept since a bank for long signals can be large.
+    scales: tuple of scales (in time steps)
+    n_fft: FFT length
+    bandwidth: bandwidth of wavelet
+    dtype: complex data type of the bank
+    Return: read-only complex array (scales-by-non-negative FFT frequencies)
+    """
+    bank = np.empty((len(scales), n_fft // 2 + 1), dtype=dtype)
+    for i, s in enumerate(scales):
+        bank[i] = cmor_fft_kernel(s, n_fft, bandwidth=bandwidth)
+    bank.flags.writeable = False
+    return bank
+
+
+def cwt_fft_length(n, scales):
+    """FFT length for wavelet transform of n time steps. Zeros are padded to
+    avoid circular convolution by wavelet support, up to the signal length."""
+    return sfft.next_fast_len(n + min(int(np.ceil(16 * max(scales))), n))
+
+
+def fft_filter_bank(x, kernels, n_fft, axis=-1, dtype=None,
+                    chunk_size=None, func=None):
+    """Apply a bank of filters to input in one FFT pass. A forward FFT of the
+    input is multiplied by the frequency response of each filter, followed by
+    one batched inverse FFT of all filters with zero negative frequencies.
+    x: input array
+    kernels: responses of filters on non-negative FFT frequencies
+    n_fft: FFT length (not less than the time steps of x)
+    axis: time axis of x
+    dtype: float data type of the computation, e.g. np.float32 to save memory
+    chunk_size: number of channels (other than time axis) in each chunk
+    func: function applied to complex output, e.g. np.abs. It reduces memory
+        when the output is real.
+    Return: array with a new first axis for the filters
+    """
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    shape = x.shape
+    x = x.reshape(-1, shape[-1])
+    N = shape[-1]
+    dtype = np.result_type(x.dtype, np.float32) if dtype is None else dtype
+    # No copy if kernels are already in the complex type of the computation
+    kernels = np.asarray(kernels, dtype=np.result_type(dtype, np.complex64))
+    chunk_size = x.shape[0] if chunk_size is None else max(chunk_size, 1)
+
+    x_a = None
+    for i in range(0, x.shape[0], chunk_size):
+        x_fft = sfft.rfft(x[i:i + chunk_size].astype(dtype), n=n_fft, axis=-1)
+        x_fft = kernels[:, None, :] * x_fft
+        # Inverse FFT of one-sided spectrum with zero negative frequencies
+        xx = sfft.ifft(x_fft, n=n_fft, axis=-1)[..., :N]
+        if func is not None:
+            xx = func(xx)
+        if x_a is None:
+            x_a = np.empty((len(kernels), x.shape[0], N), dtype=xx.dtype)
+        x_a[:, i:i + chunk_size] = xx
+    x_a = x_a.reshape((len(kernels), ) + shape)
+    return np.moveaxis(x_a, -1, axis % len(shape) + 1)
+
+
+def cwt_fft(x, scales, bandwidth=1.0, axis=-1, dtype=None,
+            chunk_size=None, func=None):
+    """Continuous wavelet transform with complex Morlet wavelet by FFT
+    convolution, matching pywt.cwt with wavelet 'cmor{2*bandwidth^2}-1.0'.
+    x: input array
+    scales: list of scales (in time steps)
+    bandwidth: bandwidth of wavelet
+    axis, dtype, chunk_size, func: arguments for `fft_filter_bank`
+    Return: coefficients with a new first axis for scales
+    """
+    scales = tuple(float(s) for s in np.ravel(scales))
+    n_fft = cwt_fft_length(np.shape(x)[axis], scales)
+    if dtype is None:
+        dtype = np.result_type(np.asarray(x).dtype, np.float32)
+    kernels = cmor_wavelet_bank(scales, n_fft, bandwidth=bandwidth,
+        dtype=np.dtype(np.result_type(dtype, np.complex64)))
+    return fft_filter_bank(x, kernels, n_fft, axis=axis, dtype=dtype,
+                           chunk_size=chunk_size, func=func)
+
+
+def wave_fft(x, freqs, fs, transform='hilbert', axis=-1, dtype=None,
+             chunk_size=None, func=None, filt_order=2, bandwidth=1.0):
+    """Analytic signals of multiple frequency bands in one FFT pass.
+    x: input array
+    freqs: list of frequency bands (Hz) for 'hilbert' transform, as in
+        `wave_hilbert`, or center frequencies (Hz) for 'cwt', as in `wave_cwt`
+    fs: sampling frequency (Hz)
+    transform: 'hilbert' for bandpass filter followed by Hilbert transform,
+        where filtering is circular as the Hilbert transform; or 'cwt' for
+        complex Morlet wavelet transform with zero padding at the ends.
+    axis, dtype, chunk_size, func: arguments for `fft_filter_bank`
+    filt_order: order of Butterworth filter for 'hilbert'
+    bandwidth: bandwidth of wavelet for 'cwt'
+    Return: array with a new first axis for the bands
+    """
+    if transform == 'cwt':
+        return cwt_fft(x, fs / np.asarray(freqs, dtype=float),
+                       bandwidth=bandwidth, axis=axis, dtype=dtype,
+                       chunk_size=chunk_size, func=func)
+    if transform != 'hilbert':
+        raise ValueError("`transform` should be 'hilbert' or 'cwt'.")
+    n_fft = np.shape(x)[axis]
+    f = np.fft.rfftfreq(n_fft, d=1 / fs)
+    # Analytic signal doubles positive frequencies
+    weight = np.full(f.size, 2.)
+    weight[0] = 1.
+    if n_fft % 2 == 0:
+        weight[-1] = 1.
+    kernels = np.array([weight * butter_band_gain(
+        band, fs, f, filt_order=filt_order) for band in freqs])
+    return fft_filter_bank(x, kernels, n_fft, axis=axis, dtype=dtype,
+                           chunk_size=chunk_size, func=func)
+
+
+def get_waves(da, fs, waves, transform, dim='time', component='amp',
+              batch=True, dtype=None, chunk_size=None, **kwargs):
+    """Get amplitude or phase of waves in frequency bands
+    da: input DataArray
+    fs: sampling frequency (Hz)
+    waves: dictionary of {wave name: frequency band or center frequency}
+    transform: `wave_hilbert` or `wave_cwt`
+    dim: time dimension
+    component: 'amp' for amplitude or 'pha' for phase
+    batch: whether use `wave_fft` to compute all waves in one FFT pass
+    dtype, chunk_size: arguments for `wave_fft`
+    kwargs: keyword arguments for the transform
+    Return: DataArray with a new dimension `wave`
+    """
     axis = da.dims.index(dim)
     comp_funcs = {'amp': np.abs, 'pha': np.angle}
     comp_func = comp_funcs.get(component, comp_funcs['amp'])
+    transforms = {wave_hilbert: 'hilbert', wave_cwt: 'cwt'}
+    if batch and transform in transforms:
+        x = wave_fft(da.values, list(waves.values()), fs,
+                     transform=transforms[transform], axis=axis, dtype=dtype,
+                     chunk_size=chunk_size, func=comp_func, **kwargs)
+        x = xr.DataArray(x, dims=('wave', ) + da.dims,
+                         coords={**da.coords, 'wave': list(waves.keys())},
+                         attrs=da.attrs, name=da.name)
+        return x
+    x = [xr.zeros_like(da) for _ in range(len(waves))]
     for i, freq in enumerate(waves.values()):
         x_a = transform(da.values, freq, fs, axis=axis, **kwargs)
         x[i][:] = comp_func(x_a)
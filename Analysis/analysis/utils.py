@@ -5,6 +5,8 @@ import json
 import h5py
 import os
 import copy
+from xarray.backends import BackendArray
+from xarray.core import indexing
 
 STIMULUS_CONFIG = {
     'baseline': 'config_baseline.json',
@@ -88,14 +90,229 @@ def load_spikes_to_df(spike_file, network_name):
             'node_ids': f['spikes'][network_name]['node_ids'],
             'timestamps': f['spikes'][network_name]['timestamps']
         })
-        spikes_df.sort_values(by='timestamps', inplace=True, ignore_index=True)
+        if not is_sorted_by_time(f['spikes'][network_name]):
+            spikes_df.sort_values(by='timestamps', inplace=True, ignore_index=True)
     return spikes_df
 
 
-def load_ecp_to_xarray(ecp_file, demean=False):
+def is_sorted_by_time(spikes_grp):
+    """Whether spikes of a population group in SONATA file are sorted by time"""
+    sorting = spikes_grp.attrs.get('sorting', '')
+    if isinstance(sorting, bytes):
+        sorting = sorting.decode()
+    return sorting == 'by_time'
+
+
+SPIKE_STORE_FILES = ('node_ids', 'timestamps', 'node_indptr',
+                     'node_timestamps', 'bin_indptr')
+
+
+def spikes_to_store(spike_file, network_name, store_path=None,
+                    num_cells=None, bin_size=100.):
+    """Convert spikes in SONATA file into columnar spike store, a directory of
+    npy files that can be memory-mapped by `SpikeStore`:
+        node_ids, timestamps: time-sorted node ids (uint32), times (float32, ms)
+        node_indptr, node_timestamps: CSR index of spike times of each node,
+            spike times of node i are node_timestamps[indptr[i]:indptr[i + 1]]
+        bin_indptr: offsets of the first spike in each coarse time bin
+    spike_file: SONATA spikes file
+    network_name: population name in the spikes file
+    store_path: directory of the store. Defaults to '<spike_file>_<network>'
+    num_cells: number of cells (that determines maximum node id)
+    bin_size: coarse time bin size (ms) of the time index
+    Return: store path
+    """
+    if store_path is None:
+        store_path = os.path.splitext(spike_file)[0] + '_' + network_name
+    with h5py.File(spike_file, 'r') as f:
+        grp = f['spikes'][network_name]
+        node_ids = grp['node_ids'][()].astype(np.uint32)
+        timestamps = grp['timestamps'][()]
+        if not is_sorted_by_time(grp):
+            order = np.argsort(timestamps, kind='stable')
+            node_ids, timestamps = node_ids[order], timestamps[order]
+    if num_cells is None:
+        num_cells = int(node_ids.max()) + 1 if node_ids.size else 0
+    if node_ids.size and node_ids.max() >= num_cells:
+        raise ValueError("Node ids in spike file exceed `num_cells`.")
+    timestamps = timestamps.astype(np.float32)
+
+    # Stable sort by node keeps spike times of each node in order
+    node_order = np.argsort(node_ids, kind='stable')
+    node_indptr = np.zeros(num_cells + 1, dtype=np.int64)
+    node_indptr[1:] = np.cumsum(np.bincount(node_ids, minlength=num_cells))
+    t_max = float(timestamps[-1]) if timestamps.size else 0.
+    bin_edges = bin_size * np.arange(int(t_max // bin_size) + 2)
+    bin_indptr = np.searchsorted(timestamps, bin_edges).astype(np.int64)
+
+    os.makedirs(store_path, exist_ok=True)
+    arrays = dict(node_ids=node_ids, timestamps=timestamps,
+                  node_indptr=node_indptr,
+                  node_timestamps=timestamps[node_order],
+                  bin_indptr=bin_indptr)
+    for key in SPIKE_STORE_FILES:
+        np.save(os.path.join(store_path, key + '.npy'), arrays[key])
+    with open(os.path.join(store_path, 'meta.json'), 'w') as f:
+        json.dump(dict(spike_file=os.path.abspath(spike_file),
+                       network_name=network_name, bin_size=bin_size,
+                       num_cells=num_cells, n_spikes=int(node_ids.size)), f)
+    return store_path
+
+
+class SpikeStore(object):
+    """Memory-mapped columnar spike store created by `spikes_to_store`.
+    Spikes in a time window are a slice of the time-sorted arrays, found by
+    the coarse time bin index. Spikes of a node are a slice of the CSR arrays.
+    """
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        for key in SPIKE_STORE_FILES:
+            setattr(self, key, np.load(os.path.join(store_path, key + '.npy'),
+                                       mmap_mode='r'))
+        self.bin_size = self.meta['bin_size']
+        self.num_cells = self.meta['num_cells']
+
+    def __len__(self):
+        return self.node_ids.size
+
+    def spike_count(self):
+        """Number of spikes of each node"""
+        return np.diff(self.node_indptr)
+
+    def time_slice(self, t_start=None, t_stop=None):
+        """Slice of time-sorted arrays of spikes in time window [start, stop)"""
+        n_bins = self.bin_indptr.size - 1
+        def index(t, i):
+            if t is None:
+                return i
+            b = min(max(int(t // self.bin_size), 0), n_bins)
+            lo, hi = self.bin_indptr[b], self.bin_indptr[min(b + 1, n_bins)]
+            if b == n_bins:
+                hi = self.node_ids.size
+            return lo + np.searchsorted(self.timestamps[lo:hi], t)
+        return slice(index(t_start, 0), index(t_stop, self.node_ids.size))
+
+    def node_timestamps_of(self, node_id):
+        """Spike times of a node (read-only view)"""
+        return self.node_timestamps[
+            self.node_indptr[node_id]:self.node_indptr[node_id + 1]]
+
+    def spikes(self, node_ids=None, t_start=None, t_stop=None):
+        """Spikes of nodes in time window [start, stop), sorted by time
+        node_ids: array of node ids. Defaults to all nodes.
+        t_start, t_stop: time window (ms). Defaults to all time.
+        Return: node ids, spike times
+        """
+        tslc = self.time_slice(t_start, t_stop)
+        if node_ids is None:
+            return self.node_ids[tslc], self.timestamps[tslc]
+        node_ids = np.unique(np.asarray(node_ids, dtype=np.int64))
+        node_ids = node_ids[(node_ids >= 0) & (node_ids < self.num_cells)]
+        start = self.node_indptr[node_ids]
+        counts = self.node_indptr[node_ids + 1] - start
+        if tslc.stop - tslc.start <= counts.sum():
+            # Fewer spikes in the time window than of the nodes
+            mask = np.zeros(self.num_cells, dtype=bool)
+            mask[node_ids] = True
+            ids, ts = self.node_ids[tslc], self.timestamps[tslc]
+            idx = mask[ids]
+            return ids[idx], ts[idx]
+        if node_ids.size and np.all(np.diff(node_ids) == 1):
+            # Contiguous node ids are a single slice of the CSR arrays
+            ts = self.node_timestamps[start[0]:start[-1] + counts[-1]]
+        else:
+            offset = np.repeat(start - np.cumsum(counts) + counts, counts)
+            ts = self.node_timestamps[offset + np.arange(counts.sum())]
+        ids = np.repeat(node_ids.astype(np.uint32), counts)
+        idx = np.ones(ts.size, dtype=bool)
+        if t_start is not None:
+            idx &= ts >= t_start
+        if t_stop is not None:
+            idx &= ts < t_stop
+        ids, ts = ids[idx], ts[idx]
+        order = np.argsort(ts, kind='stable')
+        return ids[order], ts[order]
+
+    def to_df(self, node_ids=None, t_start=None, t_stop=None):
+        """Spikes of nodes in time window in dataframe like `load_spikes_to_df`"""
+        ids, ts = self.spikes(node_ids, t_start, t_stop)
+        return pd.DataFrame({'node_ids': np.asarray(ids),
+                             'timestamps': np.asarray(ts)})
+
+
+def load_spike_store(spike_file, network_name, store_path=None, **kwargs):
+    """Load spike store of a spikes file. Convert the file if the store does
+    not exist or is older than the file.
+    kwargs: other arguments for `spikes_to_store`
+    """
+    if store_path is None:
+        store_path = os.path.splitext(spike_file)[0] + '_' + network_name
+    meta_file = os.path.join(store_path, 'meta.json')
+    if not os.path.isfile(meta_file) or \
+            os.path.getmtime(meta_file) < os.path.getmtime(spike_file):
+        spikes_to_store(spike_file, network_name, store_path=store_path, **kwargs)
+    return SpikeStore(store_path)
+
+
+class ECPArray(BackendArray):
+    """Lazily loaded ECP data array in shape (channel, time). Data are read
+    from the h5 file only for the indexed part when values are accessed."""
+    def __init__(self, ecp_file, offset=None):
+        """
+        ecp_file: ECP report h5 file
+        offset: array of offset of each channel subtracted from data
+        """
+        self.ecp_file = ecp_file
+        with h5py.File(ecp_file, 'r') as f:
+            data = f['ecp']['data']
+            self.shape = data.shape[::-1]
+            self.dtype = data.dtype
+        self.offset = offset
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.BASIC, self._getitem)
+
+    def _getitem(self, key):
+        channel_key, time_key = key
+        with h5py.File(self.ecp_file, 'r') as f:
+            data = f['ecp']['data'][time_key, channel_key].T
+        if self.offset is not None:
+            offset = self.offset[channel_key]
+            if data.ndim == 2:
+                offset = offset[:, None]
+            data = (data - offset).astype(self.dtype)
+        return data
+
+
+def ecp_channel_mean(ecp_file, chunk_size=2 ** 16):
+    """Mean of each channel of ECP data, read in chunks of time steps"""
+    with h5py.File(ecp_file, 'r') as f:
+        data = f['ecp']['data']
+        total = np.zeros(data.shape[1])
+        for i in range(0, data.shape[0], chunk_size):
+            total += data[i:i + chunk_size].sum(axis=0, dtype=float)
+        return total / data.shape[0]
+
+
+def load_ecp_to_xarray(ecp_file, demean=False, lazy=False):
+    """Load ECP report into xarray DataArray (channel_id-by-time)
+    ecp_file: ECP report h5 file
+    demean: whether subtract the mean of each channel
+    lazy: whether load data lazily. If True, data are read from file only when
+        accessed, e.g. by slicing time, and the mean is computed in chunks.
+    """
     with h5py.File(ecp_file, 'r') as f:
+        if lazy:
+            offset = ecp_channel_mean(ecp_file) if demean else None
+            data = indexing.LazilyIndexedArray(ECPArray(ecp_file, offset))
+        else:
+            data = f['ecp']['data'][()].T
         ecp = xr.DataArray(
-            f['ecp']['data'][()].T,
+            data,
+            dims = ('channel_id', 'time'),
             coords = dict(
                 channel_id = f['ecp']['channel_id'][()],
                 time = np.arange(*f['ecp']['time']) # ms
@@ -104,6 +321,6 @@ def load_ecp_to_xarray(ecp_file, demean=False):
                 fs = 1000 / f['ecp']['time'][2] # Hz
             )
         )
-    if demean:
+    if demean and not lazy:
         ecp -= ecp.mean(dim='time')
     return ecp
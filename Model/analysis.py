@@ -8,6 +8,7 @@ from scipy.signal import hanning,welch,decimate
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba
 import pandas as pd
 import sys
 
@@ -18,14 +19,39 @@ from bmtk.analyzer.spike_trains import plot_raster
 
 
 
-def raster(spikes_df,node_set,skip_ms=0,ax=None):
+def raster(spikes_df,node_set,skip_ms=0,ax=None,rasterize=False,n_columns=None,n_rows=None):
     spikes_df = spikes_df[spikes_df['timestamps']>skip_ms] 
-    for node in node_set:
-        cells = range(node['start'],node['end']+1) #+1 to be inclusive of last cell
-        cell_spikes = spikes_df[spikes_df['node_ids'].isin(cells)]
+    if rasterize:
+        #bin spikes into a cell row by time column image instead of a marker per spike
+        bbox = ax.get_window_extent()
+        if n_columns is None:
+            n_columns = max(int(np.ceil(bbox.width)),1) #axis width in pixels
+        if n_rows is None:
+            n_rows = max(int(np.ceil(bbox.height)),1) #axis height in pixels
+        node_ids = spikes_df['node_ids'].values.astype(int)
+        timestamps = spikes_df['timestamps'].values
+        id_min = min(node['start'] for node in node_set)
+        n_ids = max(node['end'] for node in node_set) - id_min + 1
+        n_rows = min(n_rows,n_ids) #bin consecutive cells into a row so none is dropped when drawn
+        t0 = skip_ms
+        t1 = max(timestamps.max() if timestamps.size else t0, t0 + 1.)
+        col = np.minimum(((timestamps-t0)/(t1-t0)*n_columns).astype(int),n_columns-1)
+        img = np.zeros((n_rows*n_columns,4),dtype=np.float32)
+        for node in node_set:
+            cells = (node_ids>=node['start']) & (node_ids<=node['end'])
+            row = (node_ids[cells]-id_min)*n_rows//n_ids
+            count = np.bincount(row*n_columns+col[cells],minlength=n_rows*n_columns)
+            img[count>0] = to_rgba('tab:'+node['color'])
+            ax.scatter([],[],c='tab:'+node['color'],marker='s',label=node['name'])
+        ax.imshow(img.reshape(n_rows,n_columns,4),extent=(t0,t1,id_min-0.5,id_min+n_ids-0.5),
+                  origin='lower',aspect='auto',interpolation='nearest')
+    else:
+        for node in node_set:
+            cells = range(node['start'],node['end']+1) #+1 to be inclusive of last cell
+            cell_spikes = spikes_df[spikes_df['node_ids'].isin(cells)]
 
-        ax.scatter(cell_spikes['timestamps'],cell_spikes['node_ids'],
-                   c='tab:'+node['color'],s=0.25, label=node['name'])
+            ax.scatter(cell_spikes['timestamps'],cell_spikes['node_ids'],
+                       c='tab:'+node['color'],s=0.25, label=node['name'])
     
     handles,labels = ax.get_legend_handles_labels()
     ax.legend(reversed(handles), reversed(labels))
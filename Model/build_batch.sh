@@ -7,9 +7,9 @@
 #SBATCH -N 1
 #SBATCH -n 1 # used for MPI codes, otherwise leave at '1'
 ##SBATCH --ntasks-per-node=1  # don't trust SLURM to divide the cores evenly
-##SBATCH --cpus-per-task=1  # cores per task; set to one if using MPI
+#SBATCH --cpus-per-task=24  # worker processes for building connections
 ##SBATCH --exclusive  # using MPI with 90+% of the cores you should go exclusive
-#SBATCH --mem-per-cpu=16G  # memory per core; default is 1GB/core
+#SBATCH --mem-per-cpu=4G  # memory per core; default is 1GB/core
 
 ## send mail to this address, alert at start, end and abortion of execution
 ##SBATCH --mail-type=ALL
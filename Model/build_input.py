@@ -3,11 +3,13 @@ import csv
 import json
 import time
 import argparse
+import multiprocessing
 
+import h5py
 import numpy as np
 import pandas as pd
 from bmtool.util import util
-from bmtk.utils.reports.spike_trains import PoissonSpikeGenerator
+from spike_generator import PoissonSpikeGenerator
 
 
 INPUT_PATH = "./input"
@@ -16,6 +18,7 @@ STIMULUS = ['baseline', 'short', 'long']
 N_ASSEMBLIES = 9  # number of assemblies
 NET_SEED = 4321  # random seed for network r.v.'s (e.g. assemblies, firing rate)
 PSG_SEED = 0  # poisson spike generator random seed for different trials
+TRIAL_SEED_STEP = 10000  # step of PSG_SEED between trials in a batch
 rng = np.random.default_rng(NET_SEED)
 
 T_STOP = 28.  # sec. Simulation time
@@ -67,8 +70,8 @@ def psg_lognormal_fr(psg, node_ids, mean, stdev, times):
     Then add the firing rate of each node to the given PoissonSpikeGenerator.
     """
     firing_rates = lognormal(mean, stdev, len(node_ids))
-    for node_id, fr in zip(node_ids, firing_rates):
-        psg.add(node_ids=node_id, firing_rate=fr, times=times)
+    psg.add(node_ids=node_ids, times=times,
+            firing_rate=np.outer(firing_rates, np.ones(len(times))))
     return firing_rates
 
 
@@ -93,6 +96,38 @@ def get_populations(node_df, pop_names, only_id=False):
     return {p: func(node_df, p) for p in pop_names}
 
 
+def edges_source_mask(edges_file, chunk_size=2 ** 22):
+    """Get boolean mask indexed by node id of source nodes that have edges.
+    Read only source node ids from SONATA edges file in chunks.
+    """
+    mask = np.zeros(0, dtype=bool)
+    with h5py.File(edges_file, 'r') as h5:
+        for edges in h5['edges'].values():
+            source_ids = edges['source_node_id']
+            for i in range(0, source_ids.shape[0], chunk_size):
+                ids = source_ids[i:i + chunk_size]
+                if ids.size and ids.max() >= mask.size:
+                    mask = np.append(mask, np.zeros(
+                        ids.max() + 1 - mask.size, dtype=bool))
+                mask[ids] = True
+    return mask
+
+
+def get_effective_populations(node_df, pop_names, source_mask):
+    """Get ids of nodes in source mask for multiple populations
+    node_df: nodes dataframe
+    pop_names: population names
+    source_mask: boolean mask indexed by node id
+    Return: dictionary of arrays of effective node ids of each population
+    """
+    node_ids = node_df.index.values
+    effective = np.zeros(node_ids.size, dtype=bool)
+    in_range = node_ids < source_mask.size
+    effective[in_range] = source_mask[node_ids[in_range]]
+    pop = node_df['pop_name'].values
+    return {p: node_ids[effective & (pop == p)] for p in pop_names}
+
+
 def get_assembly(Thal_nodes, Cortex_nodes, n_assemblies):
     """Divide PNs into n_assemblies and return lists of ids in each assembly"""
     CP_nodes, CS_nodes = Cortex_nodes['CP'], Cortex_nodes['CS']
@@ -118,22 +153,53 @@ def get_assembly(Thal_nodes, Cortex_nodes, n_assemblies):
 
 
 def input_pairs_to_file(file, source, target):
-    """Save ids of input source/target pairs to file. Rows are source ids for
-    each population followed by target ids for each population.
+    """Save ids of input source/target pairs to file.
+    For npz file, ids of all populations are concatenated into arrays
+    `source_ids` and `target_ids`, with offsets of each population in arrays
+    `source_indptr` and `target_indptr` (CSR-style).
+    For csv file, rows are source ids for each population followed by target
+    ids for each population.
     """
-    with open(file, 'w', newline='') as f:
-        writer = csv.writer(f, delimiter=',')
-        writer.writerows(source)
-        writer.writerows(target)
+    if os.path.splitext(file)[1] == '.npz':
+        arrays = {}
+        for key, ids in zip(('source', 'target'), (source, target)):
+            ids = [np.asarray(x, dtype='uint64').ravel() for x in ids]
+            arrays[key + '_indptr'] = np.cumsum([0] + [x.size for x in ids])
+            arrays[key + '_ids'] = np.concatenate(
+                [np.zeros(0, dtype='uint64')] + ids)
+        np.savez(file, **arrays)
+    else:
+        with open(file, 'w', newline='') as f:
+            writer = csv.writer(f, delimiter=',')
+            writer.writerows(source)
+            writer.writerows(target)
+
+
+def find_input_pairs_file(file):
+    """Get existing id pairs file. If not found, look for file with the same
+    name in the other format (npz or csv)."""
+    if not os.path.isfile(file):
+        root = os.path.splitext(file)[0]
+        for ext in ('.npz', '.csv'):
+            if os.path.isfile(root + ext):
+                return root + ext
+    return file
 
 
 def input_pairs_from_file(file, pop_index=None):
-    """Load ids of input source/target pairs from file"""
-    with open(file, 'r') as f:
-        ids = [np.array(row, dtype='uint64') for row in csv.reader(f)]
-    n_assemblies = len(ids) // 2
-    source = ids[:n_assemblies]
-    target = ids[n_assemblies:]
+    """Load ids of input source/target pairs from npz or csv file"""
+    file = find_input_pairs_file(file)
+    if os.path.splitext(file)[1] == '.npz':
+        with np.load(file) as f:
+            # Arrays of each population are views of the concatenated ids
+            source = np.split(f['source_ids'], f['source_indptr'][1:-1])
+            target = np.split(f['target_ids'], f['target_indptr'][1:-1])
+    else:
+        with open(file, 'r') as f:
+            ids = [np.array(row, dtype='uint64') for row in csv.reader(f)]
+        n_assemblies = len(ids) // 2
+        source = ids[:n_assemblies]
+        target = ids[n_assemblies:]
     if pop_index is not None:
         if hasattr(pop_index, '__len__'):
             source = [source[i] for i in pop_index]
@@ -584,7 +650,8 @@ def write_std_stim_file(stim_params={}, input_path=INPUT_PATH,
 
 
 def write_seeds_file(psg_seed=PSG_SEED, net_seed=NET_SEED, stimulus=STIMULUS,
-                     input_path=INPUT_PATH, seeds_file_name='random_seeds'):
+                     input_path=INPUT_PATH, seeds_file_name='random_seeds',
+                     **seed_info):
     seeds_file = os.path.join(input_path, seeds_file_name + '.json')
     if os.path.isfile(seeds_file):
         with open(seeds_file, 'r') as f:
@@ -599,7 +666,8 @@ def write_seeds_file(psg_seed=PSG_SEED, net_seed=NET_SEED, stimulus=STIMULUS,
         seed['stimulus'] += stimulus_new
         overwrite = bool(stimulus_new)
     else:
-        seed = dict(net_seed=net_seed, psg_seed=psg_seed, stimulus=stimulus)
+        seed = dict(net_seed=net_seed, psg_seed=psg_seed, stimulus=stimulus,
+                    **seed_info)
         seeds.append(seed)
         overwrite = True
     if overwrite:
@@ -607,38 +675,81 @@ def write_seeds_file(psg_seed=PSG_SEED, net_seed=NET_SEED, stimulus=STIMULUS,
             json.dump(seeds, f, indent=2)
 
 
-def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
-                burst_fr=None, psg_seed=PSG_SEED, input_path=INPUT_PATH,
-                stimulus=STIMULUS, stim_files={}):
-    if not os.path.isdir(input_path):
-        os.makedirs(input_path)
-        print("The new input directory is created!")
-
+def load_network(n_assemblies=N_ASSEMBLIES, input_path=INPUT_PATH,
+                 stimulus=STIMULUS):
+    """Load nodes, assign assemblies and find effective shell nodes, which are
+    shared by all trials of input.
+    n_assemblies: number of assemblies. If 0, load assemblies from file.
+    input_path: directory of assembly file to load from
+    stimulus: list of stimulus types
+    Return: dictionary of network nodes and assemblies
+    """
     # Get nodes in pandas dataframe
     nodes = util.load_nodes_from_config("config.json")
     pop_names = ['CP', 'CS', 'FSI', 'LTS']
     Cortex_nodes = get_populations(nodes['cortex'], pop_names, only_id=True)
 
     # Determines node ids for baseline input
+    Base_nodes = None
     if 'baseline' in stimulus:
         split_idx = np.cumsum([len(n) for n in Cortex_nodes.values()])
         Base_nodes = np.split(df2node_id(nodes['baseline']), split_idx)
         Base_nodes = dict(zip(pop_names, [n.tolist() for n in Base_nodes[:-1]]))
-        input_pairs_to_file(os.path.join(input_path, "Baseline_ids.csv"),
-                            Base_nodes.values(), Cortex_nodes.values())
 
     # Assign assemblies for PNs
-    assembly_id_file = os.path.join(input_path, "Assembly_ids.csv")
     if n_assemblies > 0:
         Thal_nodes = df2node_id(nodes['thalamus'])
         Thal_assy, PN_assy = get_assembly(Thal_nodes, Cortex_nodes, n_assemblies)
-        input_pairs_to_file(assembly_id_file, Thal_assy, PN_assy)
     elif 'baseline' in stimulus:
         raise ValueError("Use nonzero `n_assemblies` when building baseline")
     else:
-        Thal_assy, _ = input_pairs_from_file(assembly_id_file)
+        Thal_assy, PN_assy = input_pairs_from_file(
+            os.path.join(input_path, "Assembly_ids.npz"))
         n_assemblies = len(Thal_assy)
 
+    # Select effective nodes in shell that only has connections to core
+    edge_paths = util.load_config("config.json")['networks']['edges']
+    effective_nodes = {}
+    for shell in ('uncorrelated', 'shell'):
+        if shell not in nodes or \
+                (shell == 'shell' and 'baseline' not in stimulus):
+            continue
+        edges_file = next(path['edges_file'] for path in edge_paths
+                          if shell + '_cortex' in path['edges_file'])
+        effective_nodes[shell] = get_effective_populations(
+            nodes[shell], pop_names, edges_source_mask(edges_file))
+
+    net = dict(nodes=nodes, pop_names=pop_names, Cortex_nodes=Cortex_nodes,
+               Base_nodes=Base_nodes, Thal_assy=Thal_assy, PN_assy=PN_assy,
+               n_assemblies=n_assemblies, effective_nodes=effective_nodes,
+               rng_state=rng.bit_generator.state)
+    return net
+
+
+def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
+                burst_fr=None, psg_seed=PSG_SEED, input_path=INPUT_PATH,
+                stimulus=STIMULUS, stim_files={}, chunk_time=None, net=None):
+    if not os.path.isdir(input_path):
+        os.makedirs(input_path)
+        print("The new input directory is created!")
+
+    if net is None:
+        net = load_network(n_assemblies, input_path, stimulus)
+    # Network r.v.'s after loading are the same for every trial
+    rng.bit_generator.state = net['rng_state']
+    nodes = net['nodes']
+    pop_names = net['pop_names']
+    Cortex_nodes = net['Cortex_nodes']
+    Base_nodes = net['Base_nodes']
+    Thal_assy = net['Thal_assy']
+    n_assemblies = net['n_assemblies']
+
+    if 'baseline' in stimulus:
+        input_pairs_to_file(os.path.join(input_path, "Baseline_ids.npz"),
+                            Base_nodes.values(), Cortex_nodes.values())
+    input_pairs_to_file(os.path.join(input_path, "Assembly_ids.npz"),
+                        Thal_assy, net['PN_assy'])
+
     print("Building all input spike trains...")
     start_timer = time.perf_counter()
 
@@ -657,7 +768,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         psg = PoissonSpikeGenerator(population='baseline', seed=psg_seed)
         psg = get_psg_from_fr(psg, [Base_nodes['CP'] + Base_nodes['CS'],
             Base_nodes['FSI'] + Base_nodes['LTS']], fr_params)
-        psg.to_sonata(os.path.join(input_path, "baseline.h5"))
+        psg.to_sonata(os.path.join(input_path, "baseline.h5"),
+                      chunk_time=chunk_time)
 
     # Constant thalamus input
     if 'const' in stimulus:
@@ -665,7 +777,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         fr_params = get_std_param(std_stim_params, 'const')
         psg = PoissonSpikeGenerator(population='thalamus', seed=psg_seed + 100)
         psg = get_psg_from_fr(psg, Thal_assy, fr_params)
-        psg.to_sonata(os.path.join(input_path, "thalamus_const.h5"))
+        psg.to_sonata(os.path.join(input_path, "thalamus_const.h5"),
+                      chunk_time=chunk_time)
         
 
     # Short burst thalamus input
@@ -675,7 +788,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         fr_params = get_std_param(std_stim_params, 'short')
         psg = PoissonSpikeGenerator(population='thalamus', seed=psg_seed + 100)
         psg = get_psg_from_fr(psg, Thal_assy, fr_params)
-        psg.to_sonata(os.path.join(input_path, "thalamus_short.h5"))
+        psg.to_sonata(os.path.join(input_path, "thalamus_short.h5"),
+                      chunk_time=chunk_time)
 
 
     # Long burst thalamus input
@@ -685,7 +799,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         fr_params = get_std_param(std_stim_params, 'long')
         psg = PoissonSpikeGenerator(population='thalamus', seed=psg_seed + 100)
         psg = get_psg_from_fr(psg, Thal_assy, fr_params)
-        psg.to_sonata(os.path.join(input_path, "thalamus_long.h5"))
+        psg.to_sonata(os.path.join(input_path, "thalamus_long.h5"),
+                      chunk_time=chunk_time)
 
     write_std_stim_file(stim_params=std_stim_params, input_path=input_path)
 
@@ -698,7 +813,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         assy_idx = stim_setting['setting']['assembly_index']
         psg = PoissonSpikeGenerator(population='thalamus', seed=psg_seed + 100)
         psg = get_psg_from_fr(psg, [Thal_assy[i] for i in assy_idx], fr_params)
-        psg.to_sonata(stim_file.replace('.json', '.h5'))
+        psg.to_sonata(stim_file.replace('.json', '.h5'),
+                      chunk_time=chunk_time)
         with open(stim_file, 'w') as f:
             json.dump(stim_setting, f, indent=2)
 
@@ -713,7 +829,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         psg = PoissonSpikeGenerator(population='thalamus', seed=psg_seed + 100)
         psg = get_psg_from_fr(psg, split_join_assemblies(
             [Thal_assy[i] for i in assy_idx], split_ids), fr_params)
-        psg.to_sonata(stim_file.replace('.json', '.h5'))
+        psg.to_sonata(stim_file.replace('.json', '.h5'),
+                      chunk_time=chunk_time)
         with open(stim_file, 'w') as f:
             json.dump(stim_setting, f, indent=2)
 
@@ -726,7 +843,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         assy_idx = stim_setting['setting']['assembly_index']
         psg = PoissonSpikeGenerator(population='thalamus', seed=psg_seed + 100)
         psg = get_psg_from_fr(psg, [Thal_assy[i] for i in assy_idx], fr_params)
-        psg.to_sonata(stim_file.replace('.json', '.h5'))
+        psg.to_sonata(stim_file.replace('.json', '.h5'),
+                      chunk_time=chunk_time)
         with open(stim_file, 'w') as f:
             json.dump(stim_setting, f, indent=2)
 
@@ -740,17 +858,13 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         # Generate Poisson spike trains for shell cells
         psg = PoissonSpikeGenerator(population='uncorrelated', seed=psg_seed + 1000)
         uncorrelated_nodes = get_populations(nodes['uncorrelated'], pop_names, only_id=True)
-
-        # Select effective nodes in shell that only has connections to core
-        edge_paths = util.load_config("config.json")['networks']['edges']
-        _, uncorrelated_edges = util.load_edges(**next(
-            path for path in edge_paths if 'uncorrelated_cortex' in path['edges_file']))
-        effective_uncorrelated = set(uncorrelated_edges['source_node_id'])
+        # Effective nodes in shell that only has connections to core
+        effective_uncorrelated = net['effective_nodes']['uncorrelated']
 
         print("Proportion of effective cells in uncorrelated.")
         fr_list = []
         for p, node_ids in uncorrelated_nodes.items():
-            effective_ids = [x for x in node_ids if x in effective_uncorrelated]
+            effective_ids = effective_uncorrelated[p]
             ratio = len(effective_ids) / len(node_ids)
             print("%.1f%% effective %s." % (100 * ratio, p))
 
@@ -771,7 +885,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
             fr_list = pd.DataFrame(fr_list).set_index('node_id')
             fr_list.to_csv(os.path.join(input_path, "Lognormal_FR_uncorrelated.csv"))
 
-        psg.to_sonata(os.path.join(input_path, "uncorrelated.h5"))
+        psg.to_sonata(os.path.join(input_path, "uncorrelated.h5"),
+                      chunk_time=chunk_time)
         print("Uncorrelated cells: %.3f sec" % (time.perf_counter() - start_timer))
 
     write_seeds_file(psg_seed=psg_seed, net_seed=NET_SEED, stimulus=stimulus,
@@ -787,17 +902,13 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
         # Generate Poisson spike trains for shell cells
         psg = PoissonSpikeGenerator(population='shell', seed=psg_seed + 1000)
         shell_nodes = get_populations(nodes['shell'], pop_names, only_id=True)
-
-        # Select effective nodes in shell that only has connections to core
-        edge_paths = util.load_config("config.json")['networks']['edges']
-        _, shell_edges = util.load_edges(**next(
-            path for path in edge_paths if 'shell_cortex' in path['edges_file']))
-        effective_shell = set(shell_edges['source_node_id'])
+        # Effective nodes in shell that only has connections to core
+        effective_shell = net['effective_nodes']['shell']
 
         print("Proportion of effective cells in shell.")
         fr_list = []
         for p, node_ids in shell_nodes.items():
-            effective_ids = [x for x in node_ids if x in effective_shell]
+            effective_ids = effective_shell[p]
             ratio = len(effective_ids) / len(node_ids)
             print("%.1f%% effective %s." % (100 * ratio, p))
 
@@ -818,7 +929,8 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
             fr_list = pd.DataFrame(fr_list).set_index('node_id')
             fr_list.to_csv(os.path.join(input_path, "Lognormal_FR.csv"))
 
-        psg.to_sonata(os.path.join(input_path, "shell.h5"))
+        psg.to_sonata(os.path.join(input_path, "shell.h5"),
+                      chunk_time=chunk_time)
         print("Shell cells: %.3f sec" % (time.perf_counter() - start_timer))
 
     write_seeds_file(psg_seed=psg_seed, net_seed=NET_SEED, stimulus=stimulus,
@@ -826,6 +938,54 @@ def build_input(t_stop=T_STOP, t_start=T_START, n_assemblies=N_ASSEMBLIES,
     print("Done!")
 
 
+def build_input_trials(n_trials=1, psg_seed=PSG_SEED, psg_seeds=None,
+                       input_path=INPUT_PATH, n_workers=1, **kwargs):
+    """Build input of multiple trials with different Poisson generator seeds.
+    Nodes and assemblies are loaded once and shared by all trials. Trials are
+    built in parallel worker processes if n_workers > 1.
+    n_trials: number of trials
+    psg_seed: seed of the first trial. Seeds of following trials increase by
+        TRIAL_SEED_STEP, not overlapping with seed offsets within a trial.
+    psg_seeds: list of seeds of each trial. Overrides n_trials and psg_seed.
+    input_path: directory where input of each trial is in subdirectory
+        `trial_{index}`. Seeds of all trials are recorded in this directory.
+    n_workers: number of worker processes
+    kwargs: other arguments for `build_input`
+    Return: list of input paths of the trials
+    """
+    global trial_jobs
+    if psg_seeds is None:
+        psg_seeds = [psg_seed + TRIAL_SEED_STEP * i for i in range(n_trials)]
+    stimulus = kwargs.get('stimulus', STIMULUS)
+    net = load_network(kwargs.pop('n_assemblies', N_ASSEMBLIES),
+                       input_path, stimulus)
+    trial_paths = [os.path.join(input_path, 'trial_%d' % i)
+                   for i in range(len(psg_seeds))]
+    trial_jobs = [dict(psg_seed=seed, input_path=path, net=net, **kwargs)
+                  for seed, path in zip(psg_seeds, trial_paths)]
+
+    if n_workers > 1 and len(trial_jobs) > 1:
+        # Workers inherit the network by forking
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(min(n_workers, len(trial_jobs))) as pool:
+            pool.map(build_input_trial, range(len(trial_jobs)), chunksize=1)
+    else:
+        for i in range(len(trial_jobs)):
+            build_input_trial(i)
+    trial_jobs = []
+
+    for seed, path in zip(psg_seeds, trial_paths):
+        write_seeds_file(psg_seed=seed, net_seed=NET_SEED, stimulus=stimulus,
+                         input_path=input_path, seeds_file_name='random_seeds',
+                         trial_path=os.path.split(path)[1])
+    return trial_paths
+
+
+def build_input_trial(i):
+    """Build input of a trial in a worker process"""
+    build_input(**trial_jobs[i])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-stop', '--t_stop', type=float,
@@ -852,6 +1012,18 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--stimulus', type=str,
                         nargs="*", default=STIMULUS,
                         help="List of stimulus types", metavar='Stimulus')
+    parser.add_argument('-chunk', '--chunk_time', type=float,
+                        nargs='?', default=None,
+                        help="Generate spike trains in time chunks of this "
+                        "duration (sec) to limit memory", metavar='Chunk Time')
+    parser.add_argument('-trials', '--n_trials', type=int,
+                        nargs='?', default=None,
+                        help="Number of trials to build in subdirectories "
+                        "of input path", metavar='# Trials')
+    parser.add_argument('-w', '--n_workers', type=int, nargs='?',
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', 1)),
+                        help="Number of worker processes for trials",
+                        metavar='# Workers')
     parser.add_argument('-f', '--stim_files', type=str,
                         nargs="*", default=[], metavar='Stimulus Files',
                         help="Key value pairs of stimulus type and file path, "
@@ -871,7 +1043,12 @@ if __name__ == '__main__':
     NET_SEED = args.net_seed
     rng = np.random.default_rng(NET_SEED)
 
-    build_input(t_stop=args.t_stop, t_start=args.t_start,
-                n_assemblies=args.n_assemblies, burst_fr=args.burst_fr,
-                psg_seed=args.psg_seed, input_path=args.input_path,
-                stimulus=stimulus, stim_files=stim_files)
+    input_kwargs = dict(t_stop=args.t_stop, t_start=args.t_start,
+        n_assemblies=args.n_assemblies, burst_fr=args.burst_fr,
+        psg_seed=args.psg_seed, input_path=args.input_path,
+        stimulus=stimulus, stim_files=stim_files, chunk_time=args.chunk_time)
+    if args.n_trials is None:
+        build_input(**input_kwargs)
+    else:
+        build_input_trials(n_trials=args.n_trials, n_workers=args.n_workers,
+                           **input_kwargs)
@@ -1,5 +1,10 @@
 import numpy as np
 import os
+import re
+import json
+import pickle
+import hashlib
+import multiprocessing
 from functools import partial
 from bmtk.builder import NetworkBuilder
 from bmtk.utils.sim_setup import build_env_bionet
@@ -7,8 +12,8 @@ import synapses
 import connectors
 from connectors import (
     ReciprocalConnector, NormalizedReciprocalRate, UnidirectionConnector,
-    OneToOneSequentialConnector, GapJunction,
-    syn_const_delay_feng_section_PN, syn_const_delay, rho_2_pr
+    OneToOneSequentialConnector, GapJunction, BatchEdgeProperty, BATCH_RULES,
+    syn_const_delay_feng_section_PN, syn_const_delay, rho_2_pr, edge_rng
 )
 
 from homogenous_probabilities import homo_edge_probability
@@ -38,6 +43,19 @@ max_conn_dist = 300.0  # or np.inf
 # When enabled, a shell of virtual cells will be created around the core cells.
 edge_effects = False
 
+# Number of worker processes for generating connections in parallel before
+# building the networks. Use the CPUs allocated by SLURM if available.
+# Each edge type has its own random streams keyed by its name and randseed,
+# so the result does not depend on the number or the order of building.
+n_workers = int(os.environ.get('SLURM_CPUS_PER_TASK', 1))
+
+# Directory for caching generated connections of each edge type, keyed by a
+# hash of everything that determines them (random seed, node definitions,
+# connector parameters, source and target, connectors.py). Edge types whose
+# inputs are unchanged reuse the cached connections when rebuilding, e.g.,
+# when only weights are tuned. Set to None to disable.
+connection_cache_dir = 'connection_cache'
+
 ##############################################################################
 ####################### Cell Proportions and Positions #######################
 
@@ -100,12 +118,17 @@ def scale_cube(samples):
 
 
 if use_poiss_disc:
-    from scipy.stats import qmc  # qmc.PoissonDisk new in scipy 1.10.0
+    from poisson_disc import poisson_disc_sampling
 
     ncand = 30  # number of candidates (related to density of points)
-    radius = min_conn_dist / side_length
-    engine = qmc.PoissonDisk(d=3, radius=radius, ncandidates=ncand, seed=rng)
-    samples = scale_cube(engine.fill_space())
+    # Fill only the region of core and shell
+    if edge_effects:
+        sample_low = (shell_x_start, shell_y_start, z_start)
+        sample_high = (shell_x_end, shell_y_end, z_end)
+    else:
+        sample_low, sample_high = (x_start, y_start, z_start), (x_end, y_end, z_end)
+    samples = poisson_disc_sampling(sample_low, sample_high, min_conn_dist,
+                                    ncandidates=ncand, seed=rng)
 
     core_idx, pos_list = samples_in_core(samples)
     print(f"Number of positions in core: {len(pos_list):d}")
@@ -238,6 +261,9 @@ def build_edges(networks, edge_definitions, edge_params,
             # create a connector object
             connector_params = edge_params_val.pop('connector_params', {})
             connector = connector_class(**connector_params)
+            # independent random stream for each edge type
+            if connector.rng is None:
+                connector.rng = edge_rng(randseed, edge['param'])
             # keep object reference in the dictionary
             edge_params[edge['param']]['connector_object'] = connector
             if edge_src_trg:
@@ -248,10 +274,17 @@ def build_edges(networks, edge_definitions, edge_params,
         edge_properties = edge.get('add_properties')
         if edge_properties:
             edge_properties_val = edge_add_properties[edge_properties].copy()
+            rule = edge_properties_val['rule']
             if connector_class is not None:
-                # pass connector object to the rule for edge properties
-                edge_properties_val['rule'] = partial(
-                    edge_properties_val['rule'], connector=connector)
+                if rule in BATCH_RULES and hasattr(connector, 'get_edges'):
+                    # generate properties of all edges at once by batch rule
+                    edge_properties_val['rule'] = BatchEdgeProperty(
+                        BATCH_RULES[rule], connector, generator=edge_rng(
+                            randseed, edge['param'] + ' properties'))
+                else:
+                    # pass connector object to the rule for edge properties
+                    edge_properties_val['rule'] = partial(
+                        rule, connector=connector)
             conn.add_properties(**edge_properties_val)
 
 
@@ -264,6 +297,112 @@ def get_connector(param):
         raise ValueError("No connector used in '%s'" % param)
 
 
+def prebuild_connectors(connector_list, n_workers, cache_files=None):
+    """
+    Generate connections of the connectors before building the networks, in
+    parallel worker processes if n_workers > 1. Each connector uses its own
+    random generator. BMTK then uses the results when building the networks.
+    cache_files: list of cache file paths for the connectors. Load results
+        from existing files instead of generating and save new results.
+    """
+    global prebuild_jobs
+    if cache_files is None:
+        cache_files = [None] * len(connector_list)
+    prebuild_jobs = []
+    for connector, cache_file in zip(connector_list, cache_files):
+        if cache_file is not None and os.path.isfile(cache_file):
+            print("Use cached connections: " + cache_file)
+            with open(cache_file, 'rb') as f:
+                connector.set_prebuilt(pickle.load(f))
+        else:
+            prebuild_jobs.append((connector, cache_file))
+    if not prebuild_jobs:
+        return
+
+    if n_workers > 1 and len(prebuild_jobs) > 1:
+        # Workers inherit the connectors and node pools by forking
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(min(n_workers, len(prebuild_jobs))) as pool:
+            results = pool.map(prebuild_connector,
+                               range(len(prebuild_jobs)), chunksize=1)
+    else:
+        results = list(map(prebuild_connector, range(len(prebuild_jobs))))
+    for (connector, cache_file), result in zip(prebuild_jobs, results):
+        connector.set_prebuilt(result)
+        if cache_file is not None and result is not None:
+            with open(cache_file, 'wb') as f:
+                pickle.dump(result, f)
+            remove_stale_cache_files(cache_file)
+    prebuild_jobs = []
+
+
+def remove_stale_cache_files(cache_file):
+    """Remove cache files of the same edge param with other hashes, which
+    are superseded by the new cache file"""
+    cache_dir, name = os.path.split(cache_file)
+    param = name.rsplit('_', 1)[0]
+    pattern = re.compile(re.escape(param) + r'_[0-9a-f]{40}\.pkl')
+    for f in os.listdir(cache_dir):
+        if f != name and pattern.fullmatch(f):
+            os.remove(os.path.join(cache_dir, f))
+
+
+def prebuild_connector(i):
+    """Generate connections of a connector in a worker process"""
+    return prebuild_jobs[i][0].prebuild()
+
+
+def get_prebuild_connectors(*edge_params_list):
+    """Get unique connector objects that support prebuild from edge_params.
+    Return dictionary of the connectors with their edge param names as keys"""
+    connector_dict = {}
+    for params in edge_params_list:
+        for param, edge_params_val in params.items():
+            connector = edge_params_val.get('connector_object')
+            if (hasattr(connector, 'prebuild') and all(
+                    connector is not c for c in connector_dict.values())):
+                connector_dict[param] = connector
+    return connector_dict
+
+
+def content_hash(*objs):
+    """Hash of the content of objects for detecting changes of definitions.
+    Functions are identified by names and other objects by attributes."""
+    def default(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, partial):
+            return [default(obj.func), obj.args, obj.keywords]
+        if hasattr(obj, '__qualname__'):
+            return obj.__module__ + '.' + obj.__qualname__
+        return [type(obj).__qualname__, vars(obj)]
+    content = json.dumps(objs, default=default, sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def connection_cache_files(connector_dict, edge_definitions,
+                           edge_params, cache_dir):
+    """Get paths of cache files for the connectors named by the hash of the
+    definitions that determine the connections"""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(connectors.__file__) as f:
+        connectors_code = f.read()
+    nodes_hash = content_hash(network_definitions)
+    cache_files = []
+    for param in connector_dict:
+        edge = next(e.get('edge') for e in edge_definitions
+                    if e['param'] == param)
+        edge_params_val = edge_params[param]
+        key = content_hash(
+            randseed, param, edge, nodes_hash, connectors_code,
+            edge_params_val.get('connector_class'),
+            edge_params_val.get('connector_params'))
+        cache_files.append(os.path.join(cache_dir, param + '_' + key + '.pkl'))
+    return cache_files
+
+
 def save_networks(networks, network_dir):
     """Build and save network"""
     # Remove the existing network_dir directory
@@ -1508,6 +1647,7 @@ FSI_uncorr_p = 0.0450 #gotten from the fact that in V1_build, 4.5% of all possib
 gap_junc_FSI = GapJunction(
     p=FSI_uncorr_p
 )
+gap_junc_FSI.rng = edge_rng(randseed, 'FSI_gap_junction')
 population = net.nodes(pop_name='FSI')
 gap_junc_FSI.setup_nodes(source=population, target=population)
 
@@ -1525,6 +1665,7 @@ LTS_uncorr_p = 0.0145 # gotten from the fact that in V1_build, 1.45% of all poss
 gap_junc_LTS = GapJunction(
     p=LTS_uncorr_p
 )
+gap_junc_LTS.rng = edge_rng(randseed, 'LTS_gap_junction')
 population = net.nodes(pop_name='LTS')
 gap_junc_LTS.setup_nodes(source=population, target=population)
 
@@ -1538,6 +1679,18 @@ conn = net.add_edges(
 ##########################################################################
 ###############################  BUILD  ##################################
 
+# Generate connections in advance, in parallel or from cache
+if n_workers > 1 or connection_cache_dir is not None:
+    all_edge_definitions = edge_definitions + (shell_edges if edge_effects
+                                               else [])
+    all_edge_params = {**edge_params,
+                       **(shell_edge_params if edge_effects else {})}
+    prebuild_dict = get_prebuild_connectors(all_edge_params)
+    cache_files = None if connection_cache_dir is None else \
+        connection_cache_files(prebuild_dict, all_edge_definitions,
+                               all_edge_params, connection_cache_dir)
+    prebuild_connectors(list(prebuild_dict.values()), n_workers, cache_files)
+
 # Save the network into the appropriate network dir
 save_networks(networks, network_dir)
 
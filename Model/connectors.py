@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 import numpy as np
 from scipy.special import erf
 from scipy.optimize import minimize_scalar
+from scipy.spatial import cKDTree
 from functools import partial
 import time
 import types
@@ -31,6 +32,27 @@ def decisions(prob):
     return rng.random(prob.shape) < prob
 
 
+def get_generator(generator=None):
+    """Return the random generator if given, otherwise the module `rng`"""
+    return rng if generator is None else generator
+
+
+def edge_rng(seed, name):
+    """
+    Create a random generator with an independent stream for an edge type.
+    seed: base random seed of the network
+    name: name of the edge type that keys the stream
+    """
+    key = list(str(name).encode())
+    seed_seq = np.random.SeedSequence([seed, len(key)] + key)
+    return np.random.default_rng(seed_seq)
+
+
+def subset(val, mask):
+    """Select elements by mask if input is an array, otherwise return as is"""
+    return val[mask] if isinstance(val, np.ndarray) and val.ndim else val
+
+
 def euclid_dist(p1, p2):
     """
     Euclidean distance between two points
@@ -50,6 +72,19 @@ def cylindrical_dist_z(node1, node2):
     return euclid_dist(node1['positions'][:2], node2['positions'][:2]).item()
 
 
+def euclid_dist_array(p1, p2):
+    """
+    Euclidean distances between two arrays of points
+    p1, p2: Coordinates in numpy array of shape (n, ndim)
+    """
+    dvec = np.asarray(p1) - np.asarray(p2)
+    return np.einsum('ij,ij->i', dvec, dvec) ** .5
+
+
+# Number of position coordinates used by distance functions of nodes
+DIST_FUNC_NDIM = {spherical_dist: 3, cylindrical_dist_z: 2}
+
+
 # Probability Classes
 class ProbabilityFunction(ABC):
     """Abstract base class for connection probability function"""
@@ -264,9 +299,32 @@ class NormalizedReciprocalRate(ProbabilityFunction):
         return decisions(pr)
 
 
+def array_function(func):
+    """Convert a probability function for single input to accept numpy array
+    input and return numpy array. Probability classes in this module use their
+    own vectorized `probability` method. Other functions are vectorized by
+    np.vectorize, which still calls the function for each element."""
+    if isinstance(func, DistantDependentProbability):
+        def array_func(dist, *args):
+            dist = np.asarray(dist, dtype=float)
+            mask = (dist >= func.min_dist) & (dist <= func.max_dist)
+            prob = np.zeros(dist.shape)
+            prob[mask] = np.broadcast_to(func.probability(dist[mask]),
+                                         np.count_nonzero(mask))
+            return prob
+    elif isinstance(func, NormalizedReciprocalRate):
+        array_func = func.probability
+    else:
+        array_func = np.vectorize(func, otypes=[float])
+    return array_func
+
+
 # Connector Classes
 class AbstractConnector(ABC):
     """Abstract base class for connectors"""
+    # Random generator of the connector. Use the module `rng` if not assigned.
+    rng = None
+
     @abstractmethod
     def setup_nodes(self, source=None, target=None):
         """After network nodes are added to the BMTK network. Pass in the
@@ -303,6 +361,14 @@ class AbstractConnector(ABC):
             return val
         return constant
 
+    def get_rng(self):
+        """Get the random generator used by the connector"""
+        return get_generator(self.rng)
+
+    def decision(self, prob):
+        """Make single random decision using the generator of the connector"""
+        return self.get_rng().random() < prob
+
 
 # Helper class
 class Timer(object):
@@ -487,6 +553,31 @@ class ReciprocalConnector(AbstractConnector):
             the opposite case. However, it requires large memory allocation
             as the population size grows. Set it to False if there is a memory
             issue.
+        vectorized: Whether to generate the connection matrix using the
+            vectorized engine, which processes pairs in blocks with numpy
+            arrays instead of one pair at a time. Functions p0, p1, pr are
+            evaluated on arrays if they are instances of ProbabilityFunction
+            subclasses defined in this module, otherwise they are vectorized
+            by np.vectorize. Distance functions spherical_dist and
+            cylindrical_dist_z for p0_arg, p1_arg, pr_arg are calculated from
+            arrays of node positions. Other functions p0_arg, p1_arg, pr_arg,
+            n_syn0, n_syn1 are still called for each pair (or each connected
+            pair for n_syn). The random outcome is the same as the per-pair
+            algorithm given the same random state, as long as n_syn0 and n_syn1
+            do not draw from the same random generator, except that distances
+            may differ by floating point rounding error. Default: True.
+        block_size: Maximum number of pairs in each block processed by the
+            vectorized engine. Only whole rows of source cells are included
+            in a block. Larger blocks are faster but use more memory.
+        spatial_index: Whether to use a spatial index (KD-tree of target node
+            positions) in the vectorized engine when possible, so that only
+            candidate pairs within the maximum distance of nonzero probability
+            are visited. It applies when p0 (and p1) are constant zero or
+            instances of DistantDependentProbability with finite max_dist, and
+            p0_arg (and p1_arg) is spherical_dist or cylindrical_dist_z. Pairs
+            beyond the distance have zero probability and do not draw random
+            numbers, so the result is the same as without the index.
+            Default: True.
         verbose: Whether show verbose information in console.
 
     Returns:
@@ -498,17 +589,16 @@ class ReciprocalConnector(AbstractConnector):
         recurrent: Whether the source and target populations are the same.
         callable_set: Set of arguments that are functions but not constants.
         cache: ConnectorCache object for caching data.
-        conn_mat: Connection matrix
+        conn_mat: List of SparseConnections objects that store connected
+            pairs for forward and backward connections respectively. Only
+            the realized edges are stored, each with its source and target
+            indices, number of synapses, and the value of p0_arg or p1_arg.
+            Backward connections are stored with source index in the rows,
+            the same as forward connections.
         stage: Indicator of stage. 0 for forward and 1 for backward connection.
-        conn_prop: List of two dictionaries that stores properties of connected
-            pairs, for forward and backward connections respectively. In each
-            dictionary, each key is the source node id and the value is a
-            dictionary, where each key is the target node id that the source
-            node connects to, and the value is the value of p0_arg or p1_arg.
-            Example: [{sid0: {tid0: p0_arg0, tid1: p0_arg1, ...},
-                       sid1: {...}, sid2: {...}, ... },
-                      {tid2: {sid3: p1_arg0, sid4: p1_arg1, ...},
-                       tid3: {...}, tid4: {...}, ... }]
+        get_conn_prop(sid, tid): Method that returns the value of p0_arg or
+            p1_arg of a connection given the node ids of the source and target
+            in the current stage.
             This is useful when properties of edges such as distance is used to
             determine other edge properties such as delay. So the distance does
             not need to be calculated repeatedly. The connector can be passed
@@ -521,7 +611,8 @@ class ReciprocalConnector(AbstractConnector):
                  pr=0., pr_arg=None, estimate_rho=True, rho=None,
                  dist_range_forward=None, dist_range_backward=None,
                  n_syn0=1, n_syn1=1, autapses=False,
-                 cache_data=True, verbose=True):
+                 cache_data=True, vectorized=True, block_size=2 ** 20,
+                 spatial_index=True, verbose=True):
         args = locals()
         var_set = ('p0', 'p0_arg', 'p1', 'p1_arg',
                    'pr', 'pr_arg', 'n_syn0', 'n_syn1')
@@ -537,9 +628,13 @@ class ReciprocalConnector(AbstractConnector):
 
         self.autapses = autapses
         self.cache = self.ConnectorCache(cache_data and self.estimate_rho)
+        self.vectorized = vectorized
+        self.block_size = int(block_size)
+        self.spatial_index = spatial_index
         self.verbose = verbose
 
-        self.conn_prop = [{}, {}]
+        self.conn_mat = None
+        self.prebuilt = None
         self.stage = 0
         self.iter_count = 0
 
@@ -672,6 +767,90 @@ class ReciprocalConnector(AbstractConnector):
                     pass
             self.next_it = next_it
 
+    class SparseConnections(object):
+        """
+        Connected pairs of one stage stored in compressed sparse row (CSR)
+        format with flat arrays. Pairs are added during the construction of
+        connections and converted to CSR format by `finalize()`.
+
+        Attributes:
+            shape: (number of source cells, number of target cells)
+            indptr: Row pointers. Pairs of source index i are in the slice
+                indptr[i]:indptr[i + 1] of the following arrays.
+            indices: Target indices, sorted within each row.
+            n_syn: Number of synapses of each pair.
+            prop: Value of p0_arg or p1_arg of each pair.
+        """
+
+        def __init__(self, n_source, n_target):
+            self.shape = (n_source, n_target)
+            self._chunks = []
+            self._pairs = []
+            self.finalize()
+
+        def add(self, src, trg, n_syn, prop):
+            """Add arrays of connected pairs. n_syn, prop can be constant"""
+            n = len(src)
+            if n:
+                prop = np.asarray(prop)
+                if prop.ndim == 0:
+                    prop = np.full(n, prop.item(), dtype=prop.dtype)
+                self._chunks.append((np.asarray(src), np.asarray(trg),
+                                     np.broadcast_to(n_syn, (n,)), prop))
+
+        def add_pair(self, src, trg, n_syn, prop):
+            """Add a connected pair"""
+            self._pairs.append((src, trg, n_syn, prop))
+
+        def finalize(self):
+            """Convert added pairs to CSR format"""
+            chunks = self._chunks
+            if self._pairs:
+                src, trg, n_syn, prop = zip(*self._pairs)
+                chunks.append((np.array(src), np.array(trg),
+                               np.array(n_syn), np.array(prop)))
+            if chunks:
+                src, trg, n_syn, prop = map(np.concatenate, zip(*chunks))
+            else:
+                src, trg = np.zeros((2, 0), dtype=int)
+                n_syn, prop = np.zeros(0), np.zeros(0)
+            order = np.argsort(src * self.shape[1] + trg, kind='stable')
+            self.indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+            np.cumsum(np.bincount(src, minlength=self.shape[0]),
+                      out=self.indptr[1:])
+            self.indices = trg[order]
+            self.n_syn = n_syn[order].astype(np.uint8)
+            self.prop = prop[order]
+            self._chunks = []
+            self._pairs = []
+
+        @property
+        def nnz(self):
+            """Number of connected pairs with nonzero synapses"""
+            return np.count_nonzero(self.n_syn)
+
+        def row(self, i):
+            """Number of synapses from source index i to all targets"""
+            nsyns = np.zeros(self.shape[1], dtype=np.uint8)
+            idx = slice(self.indptr[i], self.indptr[i + 1])
+            nsyns[self.indices[idx]] = self.n_syn[idx]
+            return nsyns
+
+        def find(self, i, j):
+            """Position of pair (i, j) in the arrays. -1 if not connected"""
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            k = start + np.searchsorted(self.indices[start:stop], j)
+            return k if k < stop and self.indices[k] == j else -1
+
+        def keys(self, transpose=False):
+            """Sorted unique keys of pairs with nonzero synapses"""
+            src = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+            nonzero = self.n_syn > 0
+            src, trg = src[nonzero], self.indices[nonzero]
+            if transpose:
+                return np.sort(trg * self.shape[1] + src)
+            return src * self.shape[1] + trg
+
     def node_2_idx_input(self, var_func, reverse=False):
         """Convert a function that accept nodes as input
         to accept indices as input"""
@@ -699,6 +878,105 @@ class ReciprocalConnector(AbstractConnector):
                 for j in range(self.n_target):
                     yield i, j
 
+    def iterate_pair_blocks(self):
+        """Generate arrays of indices of source and target for blocks of pairs
+        in the same order as iterate_pairs(). Each block consists of whole
+        rows of source cells with total pairs not exceeding block_size unless
+        a single row exceeds it."""
+        if self.search_radius is not None:
+            yield from self.iterate_pair_blocks_spatial()
+            return
+        if self.recurrent:
+            k = 0 if self.autapses else 1  # offset of first target in row
+            n_rows = self.n_source - k
+            row_size = self.n_target - k - np.arange(n_rows)
+        else:
+            n_rows = self.n_source
+            row_size = np.full(n_rows, self.n_target)
+        cum_size = np.cumsum(row_size)
+        i0, n0 = 0, 0
+        while i0 < n_rows:
+            i1 = np.searchsorted(cum_size, n0 + self.block_size, side='right')
+            i1 = max(i1, i0 + 1)
+            rows = np.arange(i0, i1)
+            sizes = row_size[i0:i1]
+            I = np.repeat(rows, sizes)
+            if self.recurrent:
+                offset = np.repeat(np.cumsum(sizes) - sizes - rows - k, sizes)
+                J = np.arange(I.size) - offset
+            else:
+                J = np.tile(np.arange(self.n_target), rows.size)
+            yield I, J
+            i0, n0 = i1, cum_size[i1 - 1]
+
+    def iterate_pair_blocks_spatial(self):
+        """Generate blocks of candidate pairs within search_radius found by
+        radius queries in a KD-tree of target positions, in the same order as
+        iterate_pair_blocks(). Pairs beyond the radius are skipped."""
+        src_pos, trg_pos = self.node_positions()
+        ndim = self.search_ndim
+        tree = cKDTree(trg_pos[:, :ndim])
+        # Slightly enlarge radius to include pairs at the boundary
+        radius = self.search_radius * (1 + 1e-9)
+        k = 0 if self.autapses else 1
+        n_rows = max(self.block_size // self.n_target, 1)
+        i0 = 0
+        while i0 < self.n_source:
+            i1 = min(i0 + n_rows, self.n_source)
+            nbrs = tree.query_ball_point(src_pos[i0:i1, :ndim], radius,
+                                         return_sorted=True)
+            sizes = np.array([len(x) for x in nbrs], dtype=int)
+            I = np.repeat(np.arange(i0, i1), sizes)
+            J = np.concatenate(nbrs).astype(int) if I.size else I
+            if self.recurrent:
+                upper = J >= I + k
+                I, J = I[upper], J[upper]
+            if I.size:
+                yield I, J
+            # Adjust number of rows in next block by average row size
+            n_rows = max(int(self.block_size / max(sizes.mean(), 1.)), 1)
+            i0 = i1
+
+    def setup_spatial_index(self):
+        """Determine the search radius and the number of dimensions of node
+        positions for the spatial index. search_radius is None if not used."""
+        self.search_radius = None
+        if not (self.vectorized and self.spatial_index):
+            return
+
+        def prob_range(p, p_arg):
+            # Maximum distance of nonzero probability, None if not bounded
+            if not callable(p):
+                return 0. if p == 0 else None
+            if isinstance(p, DistantDependentProbability) \
+                    and p_arg in DIST_FUNC_NDIM:
+                return p.max_dist
+            return None
+
+        ranges = {}
+        for p, p_arg in (('p0', 'p0_arg'), ('p1', 'p1_arg')):
+            r = prob_range(self.vars[p], self.vars[p_arg])
+            if r is None:
+                return
+            ranges[p_arg] = max(r, ranges.get(p_arg, 0.))
+        # Pairs within distance range are counted in the estimation of rho
+        if self.estimate_rho:
+            for p_arg, dist_range in (('p0_arg', self.dist_range_forward),
+                                      ('p1_arg', self.dist_range_backward)):
+                if dist_range is not None:
+                    if self.vars[p_arg] not in DIST_FUNC_NDIM:
+                        return
+                    ranges[p_arg] = max(dist_range[1], ranges[p_arg])
+        # Distance functions in use with positive range
+        funcs = {self.vars[p_arg] for p_arg, r in ranges.items() if r > 0}
+        if len(funcs) != 1:
+            return  # no or different distance functions
+        radius = max(ranges.values())
+        if not np.isfinite(radius):
+            return
+        self.search_radius = radius
+        self.search_ndim = DIST_FUNC_NDIM[funcs.pop()]
+
     def calc_pair(self, i, j):
         """Calculate intermediate data that can be cached"""
         cache = self.cache
@@ -709,6 +987,58 @@ class ReciprocalConnector(AbstractConnector):
         p1 = p0 if self.symmetric_p1 else cache.p1(p1_arg)
         return p0_arg, p1_arg, p0, p1
 
+    def block_variable(self, name, I, J):
+        """Evaluate variable of index input for arrays of pair indices.
+        Return an array if the variable is callable, otherwise the constant"""
+        if name not in self.callable_set:
+            return self.vars[name]
+        var = self.vars[name]
+        if var in DIST_FUNC_NDIM:
+            # Distance functions calculated directly from positions
+            src_pos, trg_pos = self.node_positions()
+            ndim = DIST_FUNC_NDIM[var]
+            return euclid_dist_array(src_pos[I, :ndim], trg_pos[J, :ndim])
+        func = getattr(self, name)
+        if '1' in name:
+            val = [func(j, i) for i, j in zip(I.tolist(), J.tolist())]
+        else:
+            val = [func(i, j) for i, j in zip(I.tolist(), J.tolist())]
+        return np.array(val)
+
+    def node_positions(self):
+        """Get arrays of positions of source and target nodes"""
+        if self.positions is None:
+            src_pos = np.array([n['positions'] for n in self.source_list])
+            trg_pos = src_pos if self.recurrent else \
+                np.array([n['positions'] for n in self.target_list])
+            self.positions = (src_pos, trg_pos)
+        return self.positions
+
+    def block_probability(self, name, *args, size=None):
+        """Evaluate probability function on array input in an array of size"""
+        if name in self.callable_set:
+            prob = self.array_funcs[name](*args)
+        else:
+            prob = self.vars[name]
+        return np.broadcast_to(np.asarray(prob, dtype=float), size)
+
+    def calc_block(self, I, J):
+        """Calculate intermediate data for a block of pairs"""
+        size = I.shape
+        p0_arg = self.block_variable('p0_arg', I, J)
+        p1_arg = p0_arg if self.symmetric_p1_arg \
+            else self.block_variable('p1_arg', I, J)
+        p0 = self.block_probability('p0', p0_arg, size=size)
+        p1 = p0 if self.symmetric_p1 \
+            else self.block_probability('p1', p1_arg, size=size)
+        return p0_arg, p1_arg, p0, p1
+
+    def block_pr_arg(self, I, J, p0_arg, p1_arg):
+        """Get pr_arg for a block of pairs"""
+        if self.pr_arg_func is not None:
+            return p1_arg if '1' in self.pr_arg_func else p0_arg
+        return self.block_variable('pr_arg', I, J)
+
     def setup_conditional_backward_probability(self):
         """Create a function that calculates the conditional probability of
         backward connection given the forward connection outcome 'cond'"""
@@ -749,19 +1079,75 @@ class ReciprocalConnector(AbstractConnector):
                 return p1 + self.rho * sd * zs
         self.cond_backward = cond_backward
 
-    def add_conn_prop(self, src, trg, prop, stage=0):
-        """Store p0_arg and p1_arg for a connected pair"""
-        sid = self.source_ids[src]
-        tid = self.target_ids[trg]
-        conn_dict = self.conn_prop[stage]
+    def cond_backward_array(self, cond, p0, p1, pr):
+        """Array version of cond_backward() for the vectorized engine.
+        cond, p0, p1, pr: arrays of the same shape"""
+        if self.rho is None:
+            pr_lower, pr_upper = p0 + p1 - 1, np.fmin(p0, p1)
+            forward = p0 > 0
+            if self.verbose and np.any(forward &
+                                       ((pr < pr_lower) | (pr > pr_upper))):
+                self.wrong_pr = True
+            pr = np.fmin(np.fmax(pr, pr_lower), pr_upper)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                prob = np.where(cond, pr / p0, (p1 - pr) / (1 - p0))
+            return np.where(forward, prob, p1)
+        elif self.rho == 0:
+            return p1
+        else:
+            sd = ((1 - p1) * p1) ** .5
+            with np.errstate(divide='ignore', invalid='ignore'):
+                zs = np.where(cond, ((1 - p0) / p0) ** .5,
+                              - (p0 / (1 - p0)) ** .5)
+            return p1 + self.rho * sd * zs
+
+    def conn_exist(self, sid, tid, stage=None):
+        """Whether a connection exists given node ids in a connection.
+        Return the flag and the stored value of p0_arg or p1_arg"""
+        stage = self.stage if stage is None else stage
         if stage:
-            sid, tid = tid, sid  # during backward, from target to source
-        trg_dict = conn_dict.setdefault(sid, {})
-        trg_dict[tid] = prop
+            # during backward, from target to source
+            i, j = self.source_idx.get(tid), self.target_idx.get(sid)
+        else:
+            i, j = self.source_idx.get(sid), self.target_idx.get(tid)
+        if i is None or j is None:
+            return False, None
+        conn = self.conn_mat[stage]
+        k = conn.find(i, j)
+        if k < 0:
+            return False, None
+        return True, conn.prop[k]
 
     def get_conn_prop(self, sid, tid):
         """Get stored value given node ids in a connection"""
-        return self.conn_prop[self.stage][sid][tid]
+        exist, prop = self.conn_exist(sid, tid)
+        if not exist:
+            raise KeyError("Connection from node %d to %d not found."
+                           % (sid, tid))
+        return prop
+
+    def get_edges(self):
+        """Get arrays of source node ids, target node ids and stored values of
+        p0_arg or p1_arg of the edges with synapses in the current stage"""
+        conn = self.conn_mat[self.stage]
+        src = np.repeat(np.arange(conn.shape[0]), np.diff(conn.indptr))
+        nonzero = conn.n_syn > 0
+        sids = np.array(list(self.source_idx))[src[nonzero]]
+        tids = np.array(list(self.target_idx))[conn.indices[nonzero]]
+        if self.stage:
+            sids, tids = tids, sids  # during backward, from target to source
+        return sids, tids, conn.prop[nonzero]
+
+    def block_n_syn(self, name, src, trg):
+        """Get number of synapses for arrays of connected pairs"""
+        if name not in self.callable_set:
+            return self.vars[name]
+        func = getattr(self, name)
+        if '1' in name:
+            n_syn = [func(j, i) for i, j in zip(src.tolist(), trg.tolist())]
+        else:
+            n_syn = [func(i, j) for i, j in zip(src.tolist(), trg.tolist())]
+        return np.array(n_syn, dtype=int)
 
     # *** A sequence of major methods executed during build ***
     def setup_variables(self):
@@ -787,7 +1173,12 @@ class ReciprocalConnector(AbstractConnector):
             var = self.vars[name]
             setattr(self, name, self.node_2_idx_input(var, '1' in name))
 
+        # Functions accepting array input for the vectorized engine
+        self.array_funcs = {name: array_function(self.vars[name])
+                            for name in callable_set & {'p0', 'p1', 'pr'}}
+
         # Set up function for pr_arg if use value from p0_arg or p1_arg
+        self.pr_arg_func = pr_arg_func
         if pr_arg_func is None:
             self._pr_arg = self.pr_arg  # use specified pr_arg
         else:
@@ -818,25 +1209,39 @@ class ReciprocalConnector(AbstractConnector):
             print('Output of %s will be cached.'
                   % ', '.join(self.cache.cache_dict))
 
-    def setup_dist_range_checker(self):
+    def setup_dist_range_checker(self, array=False):
         # Checker that determines whether to consider a pair for rho estimation
+        # If array is True, the checker accepts array input from calc_block()
         if self.dist_range_forward is None and self.dist_range_backward is None:
-            def checker(var):
-                p0, p1 = var[2:]
-                return p0 > 0 and p1 > 0
-        else:
-            def in_range(p_arg, dist_range):
-                return p_arg >= dist_range[0] and p_arg <= dist_range[1]
-            r0, r1 = self.dist_range_forward, self.dist_range_backward
-            if r1 is None:
-                def checker(var):
-                    return in_range(var[0], r0)
-            elif r0 is None:
+            if array:
                 def checker(var):
-                    return in_range(var[1], r1)
+                    p0, p1 = var[2:]
+                    return (p0 > 0) & (p1 > 0)
             else:
                 def checker(var):
-                    return in_range(var[0], r0) and in_range(var[1], r1)
+                    p0, p1 = var[2:]
+                    return p0 > 0 and p1 > 0
+            return checker
+        if array:
+            def in_range(p_arg, dist_range):
+                p_arg = np.asarray(p_arg)
+                return (p_arg >= dist_range[0]) & (p_arg <= dist_range[1])
+        else:
+            def in_range(p_arg, dist_range):
+                return p_arg >= dist_range[0] and p_arg <= dist_range[1]
+        r0, r1 = self.dist_range_forward, self.dist_range_backward
+        if r1 is None:
+            def checker(var):
+                return in_range(var[0], r0)
+        elif r0 is None:
+            def checker(var):
+                return in_range(var[1], r1)
+        elif array:
+            def checker(var):
+                return in_range(var[0], r0) & in_range(var[1], r1)
+        else:
+            def checker(var):
+                return in_range(var[0], r0) and in_range(var[1], r1)
         return checker
 
     def initialize(self):
@@ -844,8 +1249,13 @@ class ReciprocalConnector(AbstractConnector):
         self.cache_variables()
         # Intialize connection matrix and get nubmer of pairs
         self.end_stage = 0 if self.recurrent else 1
-        shape = (self.end_stage + 1, self.n_source, self.n_target)
-        self.conn_mat = np.zeros(shape, dtype=np.uint8)  # 1 byte per entry
+        self.conn_mat = [self.SparseConnections(self.n_source, self.n_target)
+                         for _ in range(self.end_stage + 1)]
+        self.source_idx = {nid: i for i, nid in enumerate(self.source_ids)}
+        self.target_idx = {nid: j for j, nid in enumerate(self.target_ids)}
+        self.block_cache = None
+        self.positions = None
+        self.setup_spatial_index()
 
     def initial_all_to_all(self):
         """The major part of the algorithm run at beginning of BMTK iterator"""
@@ -854,25 +1264,15 @@ class ReciprocalConnector(AbstractConnector):
             print("\nStart building connection between: \n  "
                   + src_str + "\n  " + trg_str)
         self.initialize()
-        cache = self.cache  # write mode
 
         # Estimate pr
         if self.verbose:
             self.timer = Timer()
         if self.estimate_rho:
-            dist_range_checker = self.setup_dist_range_checker()
-            p0p1_sum = 0.
-            norm_fac_sum = 0.
-            n = 0
-            # Make sure each cacheable function runs excatly once per iteration
-            for i, j in self.iterate_pairs():
-                var = self.calc_pair(i, j)
-                valid = dist_range_checker(var)
-                if valid:
-                    n += 1
-                    p0, p1 = var[2:]
-                    p0p1_sum += p0 * p1
-                    norm_fac_sum += (p0 * (1 - p0) * p1 * (1 - p1)) ** .5
+            if self.vectorized:
+                n, p0p1_sum, norm_fac_sum = self.estimate_rho_sums_blocks()
+            else:
+                n, p0p1_sum, norm_fac_sum = self.estimate_rho_sums_pairs()
             if norm_fac_sum > 0:
                 rho = (self.pr() * n - p0p1_sum) / norm_fac_sum
                 if abs(rho) > 1:
@@ -893,6 +1293,59 @@ class ReciprocalConnector(AbstractConnector):
         self.setup_conditional_backward_probability()
 
         # Make random connections
+        if self.vectorized:
+            self.possible_count = self.connect_blocks()
+        else:
+            self.possible_count = self.connect_pairs()
+        for conn in self.conn_mat:
+            conn.finalize()
+
+        if self.verbose:
+            self.timer.report('Total time for creating connection matrix')
+            if self.wrong_pr:
+                print("Warning: Value of 'pr' outside the bounds occurred.\n")
+            self.connection_number_info()
+
+    def estimate_rho_sums_pairs(self):
+        """Sums over valid pairs for estimating rho, one pair at a time"""
+        dist_range_checker = self.setup_dist_range_checker()
+        p0p1_sum = 0.
+        norm_fac_sum = 0.
+        n = 0
+        # Make sure each cacheable function runs excatly once per iteration
+        for i, j in self.iterate_pairs():
+            var = self.calc_pair(i, j)
+            valid = dist_range_checker(var)
+            if valid:
+                n += 1
+                p0, p1 = var[2:]
+                p0p1_sum += p0 * p1
+                norm_fac_sum += (p0 * (1 - p0) * p1 * (1 - p1)) ** .5
+        return n, p0p1_sum, norm_fac_sum
+
+    def estimate_rho_sums_blocks(self):
+        """Sums over valid pairs for estimating rho, in blocks of pairs"""
+        dist_range_checker = self.setup_dist_range_checker(array=True)
+        self.block_cache = [] if self.cache.enable \
+            and len(self.cache.cache_dict) else None
+        p0p1_sum = 0.
+        norm_fac_sum = 0.
+        n = 0
+        for I, J in self.iterate_pair_blocks():
+            var = self.calc_block(I, J)
+            if self.block_cache is not None:
+                self.block_cache.append(var)
+            valid = np.broadcast_to(dist_range_checker(var), I.shape)
+            p0, p1 = var[2][valid], var[3][valid]
+            n += p0.size
+            p0p1_sum += np.sum(p0 * p1)
+            norm_fac_sum += np.sum((p0 * (1 - p0) * p1 * (1 - p1)) ** .5)
+        return n, float(p0p1_sum), float(norm_fac_sum)
+
+    def connect_pairs(self):
+        """Make random connections one pair at a time.
+        Return the number of possible connections."""
+        cache = self.cache
         cache.read_mode()
         possible_count = 0 if self.recurrent else np.zeros(3)
         for i, j in self.iterate_pairs():
@@ -907,40 +1360,88 @@ class ReciprocalConnector(AbstractConnector):
 
             # Make random decision
             if forward:
-                forward = decision(p0)
+                forward = self.decision(p0)
             if backward:
                 pr = self.pr(self._pr_arg(i, j), p0, p1)
-                backward = decision(self.cond_backward(forward, p0, p1, pr))
+                backward = self.decision(
+                    self.cond_backward(forward, p0, p1, pr))
 
             # Make connection
             if forward:
                 n_forward = self.n_syn0(i, j)
-                self.add_conn_prop(i, j, p0_arg, 0)
-                self.conn_mat[0, i, j] = n_forward
+                self.conn_mat[0].add_pair(i, j, n_forward, p0_arg)
             if backward:
                 n_backward = self.n_syn1(j, i)
                 if self.recurrent:
                     if i != j:
-                        self.conn_mat[0, j, i] = n_backward
-                        self.add_conn_prop(j, i, p1_arg, 0)
+                        self.conn_mat[0].add_pair(j, i, n_backward, p1_arg)
                 else:
-                    self.conn_mat[1, i, j] = n_backward
-                    self.add_conn_prop(i, j, p1_arg, 1)
-            self.cache.next_it()
-        self.cache.write_mode()  # clear memory
-        self.possible_count = possible_count
+                    self.conn_mat[1].add_pair(i, j, n_backward, p1_arg)
+            cache.next_it()
+        cache.write_mode()  # clear memory
+        return possible_count
+
+    def connect_blocks(self):
+        """Make random connections in blocks of pairs with numpy arrays.
+        Random numbers are drawn in the same order as in connect_pairs(),
+        forward then backward decision for each pair if they are possible.
+        Return the number of possible connections."""
+        block_cache = self.block_cache
+        self.block_cache = None
+        possible_count = 0 if self.recurrent else np.zeros(3)
+        for b, (I, J) in enumerate(self.iterate_pair_blocks()):
+            if block_cache is None:
+                p0_arg, p1_arg, p0, p1 = self.calc_block(I, J)
+            else:
+                p0_arg, p1_arg, p0, p1 = block_cache[b]
+                block_cache[b] = None  # clear memory
+            # Check whether at all possible and count
+            forward = p0 > 0
+            backward = p1 > 0
+            n_forward = np.count_nonzero(forward)
+            if self.recurrent:
+                possible_count += int(n_forward)
+            else:
+                possible_count += [n_forward, np.count_nonzero(backward),
+                                   np.count_nonzero(forward & backward)]
 
-        if self.verbose:
-            self.timer.report('Total time for creating connection matrix')
-            if self.wrong_pr:
-                print("Warning: Value of 'pr' outside the bounds occurred.\n")
-            self.connection_number_info()
+            # Draw random numbers for all decisions in the block
+            n_draw = forward.astype(int) + backward
+            draw_idx = np.cumsum(n_draw) - n_draw  # index of first draw
+            rand = self.get_rng().random(draw_idx[-1] + n_draw[-1])
+
+            # Make random decision
+            draw_idx_b = draw_idx[backward] + forward[backward]
+            forward[forward] = rand[draw_idx[forward]] < p0[forward]
+            if np.any(backward):
+                pr_arg = self.block_pr_arg(I, J, p0_arg, p1_arg)
+                p0_b, p1_b = p0[backward], p1[backward]
+                pr = self.block_probability(
+                    'pr', subset(pr_arg, backward), p0_b, p1_b,
+                    size=p0_b.shape)
+                cond = forward[backward]
+                prob = self.cond_backward_array(cond, p0_b, p1_b, pr)
+                backward[backward] = rand[draw_idx_b] < prob
+
+            # Make connection
+            i, j = I[forward], J[forward]
+            n_syn = self.block_n_syn('n_syn0', i, j)
+            self.conn_mat[0].add(i, j, n_syn, subset(p0_arg, forward))
+            if self.recurrent:
+                backward &= I != J
+            i, j = I[backward], J[backward]
+            n_syn = self.block_n_syn('n_syn1', i, j)
+            if self.recurrent:
+                self.conn_mat[0].add(j, i, n_syn, subset(p1_arg, backward))
+            else:
+                self.conn_mat[1].add(i, j, n_syn, subset(p1_arg, backward))
+        return possible_count
 
     def make_connection(self):
         """ Assign number of synapses per iteration.
         Use iterator one_to_all for forward and all_to_one for backward.
         """
-        nsyns = self.conn_mat[self.stage, self.iter_count, :]
+        nsyns = self.conn_mat[self.stage].row(self.iter_count)
         self.iter_count += 1
 
         # Detect end of iteration
@@ -957,7 +1458,13 @@ class ReciprocalConnector(AbstractConnector):
         # Initialize in the first iteration
         if self.iter_count == 0:
             self.stage = 0
-            self.initial_all_to_all()
+            if self.prebuilt is None:
+                self.initial_all_to_all()
+            else:
+                self.__dict__.update(self.prebuilt)
+                self.prebuilt = None
+                if self.verbose:
+                    self.timer = Timer()
             if self.verbose:
                 print("Assigning forward connections.")
                 self.timer.start()
@@ -971,11 +1478,24 @@ class ReciprocalConnector(AbstractConnector):
                 print("Assigning backward connections.")
         return self.make_connection()
 
+    def prebuild(self):
+        """Generate the connection matrix in advance before BMTK builds the
+        network, e.g., in a worker process. Return the results to be passed
+        to set_prebuilt(), which BMTK iterator will use instead."""
+        self.initial_all_to_all()
+        attrs = ('conn_mat', 'source_idx', 'target_idx', 'end_stage',
+                 'possible_count', 'rho')
+        return {attr: getattr(self, attr) for attr in attrs}
+
+    def set_prebuilt(self, results):
+        """Set results from prebuild()"""
+        self.prebuilt = results
+
     def free_memory(self):
         """Free up memory after connections are built"""
-        # Do not clear self.conn_prop if it will be used by conn.add_properties
-        variables = ('conn_mat', 'source_list', 'target_list',
-                     'source_ids', 'target_ids')
+        # Do not clear self.conn_mat if it will be used by conn.add_properties
+        variables = ('source_list', 'target_list',
+                     'source_ids', 'target_ids', 'positions')
         for var in variables:
             setattr(self, var, None)
 
@@ -994,20 +1514,24 @@ class ReciprocalConnector(AbstractConnector):
         n_pair: pairs of cells
         proportion: of connections in possible and total pairs
         """
-        conn_mat = self.conn_mat.astype(bool)
-        n_conn = np.count_nonzero(conn_mat, axis=(1, 2))
+        conn_mat = self.conn_mat
+        n_conn = np.array([conn.nnz for conn in conn_mat])
         n_poss = np.array(self.possible_count)
-        n_pair = conn_mat.size / 2
+        n_pair = len(conn_mat) * self.n_source * self.n_target / 2
         if self.recurrent:
-            n_recp = np.count_nonzero(conn_mat[0] & conn_mat[0].T)
+            keys = conn_mat[0].keys()
+            n_recp = np.count_nonzero(np.isin(
+                keys, conn_mat[0].keys(transpose=True), assume_unique=True))
             if self.autapses:
-                n_recp -= np.count_nonzero(np.diag(conn_mat[0]))
+                # diagonal keys i * n + i of autapses
+                n_recp -= np.count_nonzero(keys % (self.n_target + 1) == 0)
             n_recp //= 2
             n_conn -= n_recp
             n_poss = n_poss[None]
             n_pair += (1 if self.autapses else -1) * self.n_source / 2
         else:
-            n_recp = np.count_nonzero(conn_mat[0] & conn_mat[1])
+            n_recp = np.intersect1d(conn_mat[0].keys(), conn_mat[1].keys(),
+                                    assume_unique=True).size
         n_conn = np.append(n_conn, n_recp)
         n_pair = int(n_pair)
         fraction = np.array([n_conn / n_poss, n_conn / n_pair])
@@ -1045,6 +1569,21 @@ class UnidirectionConnector(AbstractConnector):
         n_syn: Number of synapses in the forward connection if connected. It
             can be a constant or a (deterministic or random) function whose
             input arguments are two node objects in BMTK like p_arg.
+        skip_sampling: Whether to use geometric skip sampling when p is
+            constant. Instead of a random decision for each pair, the gaps
+            between successive connected pairs are drawn from a geometric
+            distribution, so the cost scales with the number of connections
+            instead of the number of pairs. Connections are assigned for all
+            targets of a source at a time using the one_to_all iterator.
+            p_arg and n_syn are only evaluated for connected pairs.
+            Default: True.
+        spatial_index: Whether to use a spatial index (KD-tree of target node
+            positions) when p is an instance of DistantDependentProbability
+            with finite max_dist and p_arg is spherical_dist or
+            cylindrical_dist_z. Only candidate pairs within max_dist are
+            evaluated, with decisions made for all of them at once, and
+            connections are assigned using the one_to_all iterator like skip
+            sampling. Default: True.
         verbose: Whether show verbose information in console.
 
     Returns:
@@ -1062,13 +1601,19 @@ class UnidirectionConnector(AbstractConnector):
             This is useful in similar manner as in ReciprocalConnector.
     """
 
-    def __init__(self, p=1., p_arg=None, n_syn=1, verbose=True):
+    def __init__(self, p=1., p_arg=None, n_syn=1, skip_sampling=True,
+                 spatial_index=True, verbose=True):
         args = locals()
         var_set = ('p', 'p_arg', 'n_syn')
         self.vars = {key: args[key] for key in var_set}
 
+        self.skip_sampling = skip_sampling and not callable(p)
+        self.spatial_index = spatial_index \
+            and isinstance(p, DistantDependentProbability) \
+            and np.isfinite(p.max_dist) and p_arg in DIST_FUNC_NDIM
         self.verbose = verbose
         self.conn_prop = {}
+        self.prebuilt = None
         self.iter_count = 0
 
     # *** Two methods executed during bmtk edge creation net.add_edges() ***
@@ -1085,9 +1630,14 @@ class UnidirectionConnector(AbstractConnector):
 
     def edge_params(self):
         """Create the arguments for BMTK add_edges() method"""
-        params = {'source': self.source, 'target': self.target,
-                  'iterator': 'one_to_one',
-                  'connection_rule': self.make_connection}
+        if self.skip_sampling or self.spatial_index:
+            params = {'source': self.source, 'target': self.target,
+                      'iterator': 'one_to_all',
+                      'connection_rule': self.make_connection_skip}
+        else:
+            params = {'source': self.source, 'target': self.target,
+                      'iterator': 'one_to_one',
+                      'connection_rule': self.make_connection}
         return params
 
     # *** Methods executed during bmtk network.build() ***
@@ -1101,6 +1651,17 @@ class UnidirectionConnector(AbstractConnector):
         """Get stored value given node ids in a connection"""
         return self.conn_prop[sid][tid]
 
+    def get_edges(self):
+        """Get arrays of source node ids, target node ids and stored values of
+        p_arg of the connected pairs"""
+        edges = [(sid, tid, prop) for sid, trg_dict in self.conn_prop.items()
+                 for tid, prop in trg_dict.items()]
+        if not edges:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), \
+                np.zeros(0)
+        sids, tids, props = zip(*edges)
+        return np.array(sids), np.array(tids), np.array(props)
+
     def setup_variables(self):
         """Make constant variables constant functions"""
         for name, var in self.vars.items():
@@ -1131,7 +1692,7 @@ class UnidirectionConnector(AbstractConnector):
         p = self.p(p_arg)
         possible = p > 0
         self.n_poss += possible
-        if possible and decision(p):
+        if possible and self.decision(p):
             nsyns = self.n_syn(source, target)
             self.add_conn_prop(source.node_id, target.node_id, p_arg)
             self.n_conn += 1
@@ -1147,6 +1708,105 @@ class UnidirectionConnector(AbstractConnector):
                 self.timer.report('Done! \nTime for building connections')
         return nsyns
 
+    def skip_sample(self, p):
+        """Draw indices of connected pairs in all pairs (row-major order of
+        source and target) by sampling the gaps between successive connected
+        pairs from a geometric distribution with probability p."""
+        if p <= 0:
+            return np.zeros(0, dtype=np.int64)
+        generator = self.get_rng()
+        idx = []
+        last = -1  # index of last connected pair
+        while True:
+            # Number of gaps expected to reach the end plus some margin
+            n_exp = (self.n_pair - last) * p
+            size = int(n_exp + 3 * n_exp ** .5) + 16
+            pos = last + np.cumsum(generator.geometric(p, size=size))
+            if pos[-1] >= self.n_pair:
+                idx.append(pos[pos < self.n_pair])
+                break
+            idx.append(pos)
+            last = pos[-1]
+        return np.concatenate(idx)
+
+    def prebuild(self):
+        """Sample the connected pairs in advance before BMTK builds the
+        network, e.g., in a worker process. Return the results to be passed
+        to set_prebuilt(). Return None if neither skip sampling nor spatial
+        index is used."""
+        if self.spatial_index:
+            return self.prebuild_spatial()
+        if not self.skip_sampling:
+            return None
+        p = self.vars['p']
+        n_target = len(self.target)
+        idx = self.skip_sample(p)
+        row_ptr = np.searchsorted(idx // n_target,
+                                  np.arange(len(self.source) + 1))
+        return {'trg_idx': idx % n_target, 'row_ptr': row_ptr,
+                'n_poss': self.n_pair if p > 0 else 0, 'n_conn': idx.size}
+
+    def prebuild_spatial(self):
+        """Sample the connected pairs among candidate pairs within max_dist
+        of p found by radius queries in a KD-tree of target positions"""
+        p = self.vars['p']
+        ndim = DIST_FUNC_NDIM[self.vars['p_arg']]
+        src_pos = np.array([n['positions'] for n in self.source])[:, :ndim]
+        trg_pos = np.array([n['positions'] for n in self.target])[:, :ndim]
+        tree = cKDTree(trg_pos)
+        # Slightly enlarge radius to include pairs at the boundary
+        nbrs = tree.query_ball_point(src_pos, p.max_dist * (1 + 1e-9),
+                                     return_sorted=True)
+        sizes = np.array([len(x) for x in nbrs], dtype=int)
+        I = np.repeat(np.arange(len(src_pos)), sizes)
+        J = np.concatenate(nbrs).astype(int) if I.size else I
+        prob = array_function(p)(euclid_dist_array(src_pos[I], trg_pos[J]))
+        conn = self.get_rng().random(prob.shape) < prob
+        row_ptr = np.searchsorted(I[conn], np.arange(len(src_pos) + 1))
+        return {'trg_idx': J[conn], 'row_ptr': row_ptr,
+                'n_poss': np.count_nonzero(prob > 0),
+                'n_conn': np.count_nonzero(conn)}
+
+    def set_prebuilt(self, results):
+        """Set results from prebuild()"""
+        self.prebuilt = results
+
+    def make_connection_skip(self, source, targets, *args, **kwargs):
+        """Assign number of synapses per iteration using one_to_all iterator
+        with geometric skip sampling for constant probability, or with
+        candidate pairs from spatial index"""
+        # Initialize in the first iteration
+        if self.iter_count == 0:
+            self.initialize()
+            if self.verbose:
+                src_str, trg_str = self.get_nodes_info()
+                print("\nStart building connection \n  from "
+                      + src_str + "\n  to " + trg_str)
+            results = self.prebuild() if self.prebuilt is None \
+                else self.prebuilt
+            self.__dict__.update(results)
+            self.prebuilt = None
+
+        # Make connections of the source
+        i = self.iter_count // len(targets)
+        trg_idx = self.trg_idx[self.row_ptr[i]:self.row_ptr[i + 1]]
+        nsyns = np.zeros(len(targets), dtype=int)
+        for j in trg_idx.tolist():
+            target = targets[j]
+            nsyns[j] = self.n_syn(source, target)
+            self.add_conn_prop(source.node_id, target.node_id,
+                               self.p_arg(source, target))
+
+        self.iter_count += len(targets)
+
+        # Detect end of iteration
+        if self.iter_count == self.n_pair:
+            if self.verbose:
+                self.connection_number_info()
+                self.timer.report('Done! \nTime for building connections')
+            self.trg_idx = self.row_ptr = None
+        return nsyns
+
     # *** Helper functions for verbose ***
     def get_nodes_info(self):
         """Get strings with source and target population information"""
@@ -1187,7 +1847,8 @@ class GapJunction(UnidirectionConnector):
     """
 
     def __init__(self, p=1., p_arg=None, verbose=True):
-        super().__init__(p=p, p_arg=p_arg, verbose=verbose)
+        super().__init__(p=p, p_arg=p_arg, skip_sampling=False,
+                         spatial_index=False, verbose=verbose)
 
     def setup_nodes(self, source=None, target=None):
         super().setup_nodes(source=source, target=target)
@@ -1213,7 +1874,7 @@ class GapJunction(UnidirectionConnector):
             p = self.p(p_arg)
             possible = p > 0
             self.n_poss += possible
-            if possible and decision(p):
+            if possible and self.decision(p):
                 nsyns = 1
                 sid, tid = source.node_id, target.node_id
                 self.add_conn_prop(sid, tid, p_arg)
@@ -1252,8 +1913,9 @@ class CorrelatedGapJunction(GapJunction):
             function, similar to p0_arg, p1_arg in ReciprocalConnector.
         connector: Connector object used to generate the chemical synapses of
             within this population, which contains the connection information
-            in its attribute `conn_prop`. So this connector should have
-            generated the chemical synapses before generating the gap junction.
+            in its attribute `conn_prop` (`conn_mat` for ReciprocalConnector).
+            So this connector should have generated the chemical synapses
+            before generating the gap junction.
         verbose: Whether show verbose information in console.
 
     Returns:
@@ -1270,12 +1932,14 @@ class CorrelatedGapJunction(GapJunction):
         self.vars['p_uni'] = p_uni
         self.vars['p_rec'] = p_rec
         self.connector = connector
-        conn_prop = connector.conn_prop
-        if isinstance(conn_prop, list):
-            conn_prop = conn_prop[0]
-        self.ref_conn_prop = conn_prop
+        if isinstance(connector, ReciprocalConnector):
+            self.ref_conn_prop = None  # look up in sparse connections
+        else:
+            self.ref_conn_prop = connector.conn_prop
 
     def conn_exist(self, sid, tid):
+        if self.ref_conn_prop is None:
+            return self.connector.conn_exist(sid, tid, stage=0)
         trg_dict = self.ref_conn_prop.get(sid)
         if trg_dict is not None and tid in trg_dict:
             return True, trg_dict[tid]
@@ -1315,7 +1979,7 @@ class CorrelatedGapJunction(GapJunction):
             p = self.ps[conn_type](p_arg)
             possible = p > 0
             self.n_poss += possible
-            if possible and decision(p):
+            if possible and self.decision(p):
                 nsyns = 1
                 self.add_conn_prop(sid, tid, p_arg)
                 self.add_conn_prop(tid, sid, p_arg)
@@ -1539,3 +2203,128 @@ def syn_dist_delay_feng_section_PN(source, target, p=0.9,
 def syn_uniform_delay_section(source, target, low=DELAY_LOWBOUND,
                               high=DELAY_UPBOUND, **kwargs):
     return rng.uniform(low, high)
+
+
+# Batch versions of the rules above that generate the properties of arrays of
+# edges at once. They accept arrays of source and target node ids, and the
+# stored distances of the edges in the connector as keyword `conn_dist`.
+# Keyword `generator` specifies the random generator, default module `rng`.
+def syn_const_delay_batch(source_ids, target_ids=None, dist=100,
+                          min_delay=SYN_MIN_DELAY, velocity=SYN_VELOCITY,
+                          fluc_stdev=FLUC_STDEV,
+                          delay_bound=(DELAY_LOWBOUND, DELAY_UPBOUND),
+                          conn_dist=None, generator=None):
+    """Batch version of syn_const_delay(). Return array of delays"""
+    generator = get_generator(generator)
+    del_fluc = fluc_stdev * generator.normal(size=len(source_ids))
+    delay = dist / SYN_VELOCITY + SYN_MIN_DELAY + del_fluc
+    return np.clip(delay, DELAY_LOWBOUND, DELAY_UPBOUND)
+
+
+def syn_dist_delay_feng_batch(source_ids, target_ids=None,
+                              min_delay=SYN_MIN_DELAY, velocity=SYN_VELOCITY,
+                              fluc_stdev=FLUC_STDEV,
+                              delay_bound=(DELAY_LOWBOUND, DELAY_UPBOUND),
+                              conn_dist=None, generator=None):
+    """Batch version of syn_dist_delay_feng(). Return array of delays"""
+    if conn_dist is None:
+        raise ValueError("Distances of edges are required.")
+    generator = get_generator(generator)
+    dist = np.asarray(conn_dist, dtype=float)
+    del_fluc = fluc_stdev * generator.normal(size=dist.shape)
+    delay = dist / velocity + min_delay + del_fluc
+    return np.clip(delay, delay_bound[0], delay_bound[1])
+
+
+def syn_section_PN_batch(source_ids, target_ids=None, p=0.9,
+                         sec_id=(1, 2), sec_x=(0.4, 0.6), generator=None,
+                         **kwargs):
+    """Batch version of syn_section_PN(). Return arrays of section id and
+    section position"""
+    generator = get_generator(generator)
+    syn_loc = (generator.random(len(source_ids)) >= p).astype(int)
+    return np.asarray(sec_id)[syn_loc], np.asarray(sec_x)[syn_loc]
+
+
+def syn_const_delay_feng_section_PN_batch(source_ids, target_ids=None, p=0.9,
+                                         sec_id=(1, 2), sec_x=(0.4, 0.6),
+                                         generator=None, **kwargs):
+    """Batch version of syn_const_delay_feng_section_PN()"""
+    delay = syn_const_delay_batch(source_ids, target_ids,
+                                  generator=generator, **kwargs)
+    s_id, s_x = syn_section_PN_batch(source_ids, target_ids, p=p,
+                                     sec_id=sec_id, sec_x=sec_x,
+                                     generator=generator)
+    return delay, s_id, s_x
+
+
+def syn_dist_delay_feng_section_PN_batch(source_ids, target_ids=None, p=0.9,
+                                        sec_id=(1, 2), sec_x=(0.4, 0.6),
+                                        generator=None, **kwargs):
+    """Batch version of syn_dist_delay_feng_section_PN()"""
+    delay = syn_dist_delay_feng_batch(source_ids, target_ids,
+                                      generator=generator, **kwargs)
+    s_id, s_x = syn_section_PN_batch(source_ids, target_ids, p=p,
+                                     sec_id=sec_id, sec_x=sec_x,
+                                     generator=generator)
+    return delay, s_id, s_x
+
+
+def syn_uniform_delay_section_batch(source_ids, target_ids=None,
+                                    low=DELAY_LOWBOUND, high=DELAY_UPBOUND,
+                                    generator=None, **kwargs):
+    """Batch version of syn_uniform_delay_section()"""
+    generator = get_generator(generator)
+    return generator.uniform(low, high, size=len(source_ids))
+
+
+# Map rules for single edge to their batch versions
+BATCH_RULES = {
+    syn_const_delay: syn_const_delay_batch,
+    syn_dist_delay_feng: syn_dist_delay_feng_batch,
+    syn_section_PN: syn_section_PN_batch,
+    syn_const_delay_feng_section_PN: syn_const_delay_feng_section_PN_batch,
+    syn_dist_delay_feng_section_PN: syn_dist_delay_feng_section_PN_batch,
+    syn_uniform_delay_section: syn_uniform_delay_section_batch
+}
+
+
+class BatchEdgeProperty(object):
+    """
+    Rule for BMTK add_properties() that generates the properties of all edges
+    created by a connector in one call of a batch rule, then returns the
+    values of each edge when BMTK calls it for the edge.
+
+    Parameters:
+        batch_rule: Function that accepts arrays of source and target node ids
+            and keyword argument `conn_dist` of the stored values of p_arg, and
+            returns an array of property values or a tuple of arrays for
+            multiple properties, e.g., functions in BATCH_RULES.
+        connector: Connector object that creates the edges, which has method
+            get_edges(), e.g., ReciprocalConnector, UnidirectionConnector.
+        generator: Random generator for the properties. Default module `rng`.
+    """
+
+    def __init__(self, batch_rule, connector, generator=None):
+        self.batch_rule = batch_rule
+        self.connector = connector
+        self.generator = generator
+        self.stage = None
+
+    def generate(self, **kwargs):
+        """Generate properties of all edges in the current stage"""
+        sids, tids, conn_dist = self.connector.get_edges()
+        values = self.batch_rule(sids, tids, conn_dist=conn_dist,
+                                 generator=self.generator, **kwargs)
+        if isinstance(values, tuple):
+            self.values = list(zip(*[v.tolist() for v in values]))
+        else:
+            self.values = values.tolist()
+        self.index = dict(zip(zip(sids.tolist(), tids.tolist()),
+                              range(len(sids))))
+        self.stage = getattr(self.connector, 'stage', 0)
+
+    def __call__(self, source, target, **kwargs):
+        if self.stage != getattr(self.connector, 'stage', 0):
+            self.generate(**kwargs)
+        return self.values[self.index[(source.node_id, target.node_id)]]
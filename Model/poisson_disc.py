@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def poisson_disc_sampling(low, high, radius, ncandidates=30, seed=None):
+    """
+    Bridson's Poisson-disc sampling in a box accelerated by a background grid.
+    Fill the box with random points with a minimum distance between them.
+    low, high: lower and upper bounds of the box in each dimension
+    radius: minimum distance between points
+    ncandidates: number of candidates drawn around an active point each time
+    seed: random seed or numpy random generator
+    Return array of points with shape (number of points, dimension)
+    """
+    rng = np.random.default_rng(seed)
+    low = np.asarray(low, dtype=float)
+    high = np.asarray(high, dtype=float)
+    ndim = low.size
+    # Each grid cell contains at most one point
+    cell = radius / np.sqrt(ndim)
+    shape = np.ceil((high - low) / cell).astype(int)
+    # Pad the grid with empty cells to avoid checking the bounds of neighbors
+    n = int(np.ceil(np.sqrt(ndim)))
+    padded_shape = shape + 2 * n
+    grid = np.full(np.prod(padded_shape), -1, dtype=np.int64)
+    strides = np.append(np.cumprod(padded_shape[:0:-1])[::-1], 1)
+    # Flat offsets of the neighbor cells that may contain points within radius
+    offsets = np.stack(np.meshgrid(*[np.arange(-n, n + 1)] * ndim,
+                                   indexing='ij'), axis=-1).reshape(-1, ndim)
+    offsets = offsets @ strides
+    # Candidates are uniform in the volume of spherical shell [r, 2r]
+    shell_factor = 2 ** ndim - 1
+    r2 = radius * radius
+
+    points = np.zeros((np.prod(shape) + 1, ndim))
+    n_points = 0
+    active = []
+
+    def flat_index(pts):
+        return (((pts - low) / cell).astype(int) + n) @ strides
+
+    def add_point(point):
+        nonlocal n_points
+        points[n_points] = point
+        grid[flat_index(point)] = n_points
+        active.append(n_points)
+        n_points += 1
+
+    add_point(low + rng.random(ndim) * (high - low))
+    while active:
+        k = rng.integers(len(active))
+        center = points[active[k]]
+        direction = rng.normal(size=(ncandidates, ndim))
+        dist = radius * (shell_factor * rng.random(ncandidates) + 1) \
+            ** (1 / ndim) / np.sqrt(np.sum(direction * direction, axis=1))
+        cand = center + direction * dist[:, None]
+        cand = cand[np.all((cand >= low) & (cand < high), axis=1)]
+
+        # Check distance to points in neighbor cells
+        pid = grid[flat_index(cand)[:, None] + offsets]
+        d2 = np.sum((points[pid] - cand[:, None, :]) ** 2, axis=2)
+        valid = np.all((d2 >= r2) | (pid < 0), axis=1)
+
+        if np.any(valid):
+            # Accept valid candidates that are apart from each other
+            cand = cand[valid]
+            while cand.shape[0]:
+                add_point(cand[0])
+                d2 = np.sum((cand - cand[0]) ** 2, axis=1)
+                cand = cand[d2 >= r2]
+        else:
+            # Remove from active list if no valid candidate
+            active[k] = active[-1]
+            active.pop()
+    return points[:n_points]
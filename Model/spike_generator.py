@@ -0,0 +1,147 @@
+import h5py
+import numpy as np
+
+
+class PoissonSpikeGenerator(object):
+    """Vectorized replacement of bmtk PoissonSpikeGenerator.
+    Firing rate traces are piecewise linear functions of time defined by
+    `firing_rate` at time points `times` (in seconds), the same format as the
+    parameters from `get_fr_short`, `get_fr_long`, `get_fr_ramp`, etc.
+    Repeated time points make steps. Spikes of all nodes in each segment of
+    the traces are drawn at once by thinning at the maximum rate of the segment.
+    """
+
+    def __init__(self, population=None, seed=None, output_units='ms'):
+        """
+        population: name of the node population of the spike trains
+        seed: random seed or numpy random generator
+        output_units: units of spike times in the output file, 'ms' or 's'
+        """
+        if output_units not in ('ms', 's'):
+            raise ValueError("`output_units` should be 'ms' or 's'.")
+        self.population = population
+        self.rng = np.random.default_rng(seed)
+        self.output_units = output_units
+        self.groups = []
+
+    def add(self, node_ids, firing_rate, times=(0.0, 1.0)):
+        """Add nodes with firing rate trace
+        node_ids: node id or array of node ids
+        firing_rate: constant firing rate, or array of firing rates at `times`
+            shared by all nodes, or 2D array of shape (nodes, times) for each
+        times: time points (sec) of the firing rate trace. For a constant firing
+            rate, only the first and last are used as start and stop time.
+        """
+        node_ids = np.atleast_1d(np.asarray(node_ids, dtype=np.uint64)).ravel()
+        times = np.asarray(times, dtype=float).ravel()
+        firing_rate = np.asarray(firing_rate, dtype=float)
+        if firing_rate.ndim == 0:
+            times = times[[0, -1]]
+            firing_rate = np.full(2, firing_rate)
+        if firing_rate.shape[-1] != times.size:
+            raise ValueError("Length of `firing_rate` and `times` should match.")
+        if firing_rate.ndim == 2 and firing_rate.shape[0] != node_ids.size:
+            raise ValueError("Rows of `firing_rate` should match `node_ids`.")
+        if np.any(np.diff(times) < 0):
+            raise ValueError("`times` should be non-decreasing.")
+        if np.any(firing_rate < 0):
+            raise ValueError("`firing_rate` should be non-negative.")
+        self.groups.append((node_ids, np.atleast_2d(firing_rate), times))
+
+    @property
+    def time_range(self):
+        """Start and stop time (sec) of all firing rate traces"""
+        if not self.groups:
+            return 0., 0.
+        return (min(g[2][0] for g in self.groups),
+                max(g[2][-1] for g in self.groups))
+
+    def _group_spikes(self, node_ids, firing_rate, times, t_start, t_stop):
+        """Generate spikes of a group of nodes within time window"""
+        a = np.clip(times[:-1], t_start, t_stop)
+        b = np.clip(times[1:], t_start, t_stop)
+        dur = b - a
+        seg = np.nonzero(dur > 0)[0]
+        if node_ids.size == 0 or seg.size == 0:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0)
+        # Firing rates at the segment bounds clipped by the window
+        slope = np.diff(firing_rate, axis=1)[:, seg] \
+            / (times[seg + 1] - times[seg])
+        ra = firing_rate[:, seg] + slope * (a[seg] - times[seg])
+        rb = firing_rate[:, seg] + slope * (b[seg] - times[seg])
+        max_fr = np.broadcast_to(np.fmax(ra, rb), (node_ids.size, seg.size))
+        counts = self.rng.poisson(max_fr * dur[seg])
+
+        # Uniform spike times at the maximum rate within each segment
+        idx = np.repeat(np.arange(counts.size), counts.ravel())
+        node_idx, seg_idx = np.divmod(idx, seg.size)
+        u = self.rng.random(idx.size)
+        timestamps = a[seg][seg_idx] + dur[seg][seg_idx] * u
+        # Thinning in segments with varying firing rate
+        ra = np.broadcast_to(ra, max_fr.shape).ravel()[idx]
+        rb = np.broadcast_to(rb, max_fr.shape).ravel()[idx]
+        vary = np.nonzero(ra != rb)[0]
+        fr = ra[vary] + (rb[vary] - ra[vary]) * u[vary]
+        keep = np.ones(idx.size, dtype=bool)
+        keep[vary] = self.rng.random(vary.size) * max_fr.ravel()[idx[vary]] < fr
+        return node_ids[node_idx[keep]], timestamps[keep]
+
+    def spikes(self, t_start=None, t_stop=None):
+        """Generate spikes of all nodes within time window, sorted by time
+        t_start, t_stop: time window (sec). Default is range of all traces.
+        Return: node ids, spike times (in output units)
+        """
+        start, stop = self.time_range
+        t_start = start if t_start is None else t_start
+        t_stop = stop if t_stop is None else t_stop
+        spikes = [self._group_spikes(*g, t_start, t_stop) for g in self.groups]
+        node_ids = np.concatenate([np.zeros(0, dtype=np.uint64)]
+                                  + [s[0] for s in spikes])
+        timestamps = np.concatenate([np.zeros(0)] + [s[1] for s in spikes])
+        order = np.argsort(timestamps, kind='stable')
+        if self.output_units == 'ms':
+            timestamps *= 1000.
+        return node_ids[order], timestamps[order]
+
+    def iter_spikes(self, chunk_time=None):
+        """Generate spikes in consecutive time chunks, sorted by time
+        chunk_time: duration (sec) of each chunk. Default is the whole range.
+        Yield: node ids, spike times (in output units) in each chunk
+        """
+        t_start, t_stop = self.time_range
+        if chunk_time is None or chunk_time <= 0:
+            yield self.spikes(t_start, t_stop)
+            return
+        n_chunks = max(int(np.ceil((t_stop - t_start) / chunk_time)), 1)
+        bounds = np.append(t_start + chunk_time * np.arange(n_chunks), t_stop)
+        for t0, t1 in zip(bounds[:-1], bounds[1:]):
+            yield self.spikes(t0, t1)
+
+    def to_sonata(self, path, mode='w', compression='gzip', chunk_time=None):
+        """Generate spikes and write them into SONATA spikes file
+        path: output h5 file path
+        mode: file open mode
+        compression: compression of datasets
+        chunk_time: If not specified, generate all spikes and write at once.
+            Otherwise, generate spikes in time chunks of this duration (sec)
+            and append them to resizable datasets, so that memory usage is
+            bounded by the number of spikes in a chunk.
+        """
+        with h5py.File(path, mode) as h5:
+            h5.attrs['magic'] = np.uint32(0x0A7A)
+            h5.attrs['version'] = [np.uint32(0), np.uint32(1)]
+            grp = h5.require_group('spikes').create_group(self.population)
+            grp.attrs['sorting'] = 'by_time'
+            dsets = {}
+            for key, dtype in (('node_ids', np.uint64),
+                               ('timestamps', np.float64)):
+                dsets[key] = grp.create_dataset(
+                    key, shape=(0, ), dtype=dtype, maxshape=(None, ),
+                    chunks=(2 ** 16, ), compression=compression)
+            dsets['timestamps'].attrs['units'] = self.output_units
+
+            for spikes in self.iter_spikes(chunk_time):
+                n = dsets['node_ids'].shape[0]
+                for dset, data in zip(dsets.values(), spikes):
+                    dset.resize((n + data.size, ))
+                    dset[n:] = data